@@ -0,0 +1,2 @@
+from benchmarks.generator import SyntheticData, make_rankings
+from benchmarks.suite import run_suite
@@ -0,0 +1,180 @@
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generator import make_rankings
+from epm.EPM import EPM
+from epm.metrics import batch_metrics, optimistic_estimates, score_bounds
+from epm.preference_matrix import PreferenceStats, ranking_labels
+from epm.sampling import half_widths
+from epm.sweep import Sweep
+
+def check_empty_sample():
+    """
+    The score bounds of a subgroup of which a pair has no sampled entries contain every score the
+    subgroup can have.
+    """
+    stats = PreferenceStats.from_tensor(np.array([[1., 1., 1.], [-1., 1., 1.], [1., -1., 0.]], dtype=np.float32))
+    matrix_d = stats.aggregate('mean').pm
+    # Enough sampled rows for narrow intervals on the other pairs
+    estimate = PreferenceStats.from_tensor(np.tile(np.array([[np.nan, 1., 1.]], dtype=np.float32), (100, 1)))
+    widths = half_widths(estimate, 0.99)[np.newaxis]
+    matrices_s = estimate.aggregate('mean').pm[np.newaxis]
+    for metric, bounds in score_bounds.items():
+        lower, upper = bounds(matrix_d, matrices_s, widths, np.array([1]), 3)
+        for value in (-1, 0, 1):
+            exact = matrices_s.copy()
+            exact[0, 0, 1], exact[0, 1, 0] = value, -value
+            score = batch_metrics[metric](matrix_d, exact, np.array([1]), 3)[0]
+            # NaN bounds are verified exactly
+            assert np.isnan(lower[0]) or np.isnan(upper[0]) or lower[0] - 1e-9 <= score <= upper[0] + 1e-9, \
+                f"{metric}: score {score} outside [{lower[0]}, {upper[0]}] with an unsampled pair"
+
+def check_approximate(rows: int = 5000, seed: int = 7):
+    """
+    An approximate search finds the same subgroups as the exact search, also with a sample so small
+    that pairs of candidates have no sampled entries.
+    """
+    data = make_rankings(n_rows=rows, seed=seed, missing_probability=0.1).data
+    for metric in score_bounds:
+        threshold = -0.001 if metric == 'rw_cov' else 0.01
+        for algorithm, settings in (('best_first', dict(width=5)),
+                                    ('apriori', dict(evaluation_threshold=threshold, frequency_threshold=0.05))):
+            results = []
+            for approximate in (False, True):
+                clf = EPM(depth=2, evaluation_metric=metric, algorithm=algorithm, sample_fraction=0.02, **settings)
+                clf.load_data(data)
+                clf.search(approximate=approximate)
+                results.append([s.to_string() for s in clf.algorithm.subgroups])
+            assert results[0] == results[1], f"{metric}/{algorithm}: approximate search differs in " \
+                                             f"{set(results[0]) ^ set(results[1])}"
+
+def check_missing_categorical(rows: int = 2000, seed: int = 3):
+    """
+    Missing values of a categorical column are not a value of their own, also not in appended rows.
+    """
+    data = make_rankings(n_rows=rows, seed=seed).data
+    data.loc[np.random.default_rng(seed).random(rows) < 0.05, 'c1'] = np.nan
+    expected = data['c1'].value_counts().to_dict()
+    for appended in (False, True):
+        clf = EPM(depth=1, evaluation_metric='rw_norm', algorithm='best_first', width=100)
+        clf.load_data(data.iloc[:rows // 2] if appended else data)
+        clf.search()
+        if appended:
+            clf.append_data(data.iloc[rows // 2:])
+        found = {s.description.description['c1']: s.size for s in clf.algorithm.subgroups if 'c1' in s.description}
+        assert found == expected, f"Subgroups on c1 {found}, expected {expected}"
+
+def check_streamed_missing(rows: int = 2000, seed: int = 4):
+    """
+    A CSV file streamed in chunks, with missing values in an integer column only in a later chunk, gives
+    the same subgroups as the DataFrame read from it.
+    """
+    data = make_rankings(n_rows=rows, seed=seed).data
+    data['i0'] = data['i0'].astype('Int64')
+    data.loc[rows * 3 // 4:rows * 3 // 4 + rows // 20, 'i0'] = pd.NA
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'data.csv')
+        data.to_csv(path, index=False)
+        results = []
+        for streamed in (False, True):
+            clf = EPM(depth=2, evaluation_metric='rw_norm', algorithm='best_first', width=10)
+            if streamed:
+                clf.load_data(path, chunksize=rows // 2)
+            else:
+                clf.load_data(pd.read_csv(path))
+            clf.search()
+            results.append([s.to_string() for s in clf.algorithm.subgroups])
+    assert results[0] == results[1], f"Streamed load differs in {set(results[0]) ^ set(results[1])}"
+
+def check_optimistic_estimates(rows: int = 400, seed: int = 0):
+    """
+    No refinement of a subgroup scores better than its optimistic estimate, also for a subgroup that
+    covaries negatively with the dataset.
+    """
+    rng = np.random.default_rng(seed)
+    reversed_rows = rng.random(rows) < 0.3
+    data = pd.DataFrame({'x': np.where(reversed_rows, 'yes', 'no'), 'y': rng.choice(['p', 'q', 'r'], rows),
+                         'ranking': np.where(reversed_rows, 'c>b>a', 'a>b>c')})
+    for metric, estimate in optimistic_estimates.items():
+        threshold = -0.001 if metric == 'rw_cov' else 0.001
+        clf = EPM(depth=2, evaluation_metric=metric, algorithm='apriori', evaluation_threshold=threshold,
+                  frequency_threshold=0.01)
+        clf.load_data(data)
+        sweep = Sweep(clf.settings, clf.dataset, clf.preferences, clf.index, [(metric, threshold, 0.01, 2)])
+        sweep.run(clf.data.column_names)
+        lattice, scores = sweep.algorithm.lattice, sweep.scores[metric]
+        # The estimate bounds sign * score from above
+        sign = -1 if metric == 'rw_cov' else 1
+        for parent in lattice:
+            bound = sign * estimate(clf.dataset, parent)
+            for child, score in zip(lattice, scores):
+                if set(parent.description.key) < set(child.description.key):
+                    assert sign * score <= bound + 1e-9, f"{metric}: {child.description} scores {score}, " \
+                                                         f"beyond the estimate {sign * bound} of {parent.description}"
+
+def check_ranking_labels():
+    """
+    Labels that are always tied are still single character labels, labels of more characters are only
+    inferred from rankings with separated ties and ambiguous rankings raise.
+    """
+    for rankings, expected in ((['a>bc>d', 'd>bc>a'], ['a', 'b', 'c', 'd']),
+                               (['a>b>c', 'c>ab'], ['a', 'b', 'c']),
+                               (['foo>bar=baz', 'baz>foo'], ['bar', 'baz', 'foo'])):
+        labels = ranking_labels(rankings)
+        assert labels == expected, f"Labels {labels} of {rankings}, expected {expected}"
+    for rankings in (['a>bc', 'b>c>a=d'], ['apple>banana']):
+        try:
+            ranking_labels(rankings)
+        except ValueError:
+            continue
+        raise AssertionError(f"Labels inferred from the ambiguous rankings {rankings}")
+
+def check_admission(rows: int = 2000, seed: int = 5, width: int = 5):
+    """
+    A best_first search given only a width finds its `width` best subgroups, which used to be none, and
+    with an evaluation threshold admits only the subgroups beyond it, as it did before.
+    """
+    data = make_rankings(n_rows=rows, seed=seed).data
+    found = dict()
+    for threshold in (None, 0.05):
+        clf = EPM(depth=1, evaluation_metric='rw_norm', algorithm='best_first', width=1000,
+                  evaluation_threshold=threshold)
+        clf.load_data(data)
+        clf.search()
+        found[threshold] = {s.to_string(): s.score for s in clf.algorithm.subgroups}
+    assert len(found[None]) > 0, "No subgroups found without an evaluation threshold"
+    expected = {key: score for key, score in found[None].items() if score > 0.05}
+    assert found[0.05] == expected, f"Threshold admits {set(found[0.05]) ^ set(expected)} differently"
+    clf = EPM(depth=2, evaluation_metric='rw_norm', algorithm='best_first', width=width)
+    clf.load_data(data)
+    clf.search()
+    assert len(clf.algorithm.subgroups) == width, \
+        f"{len(clf.algorithm.subgroups)} subgroups found with a width of {width} and no threshold"
+
+CHECKS = [check_empty_sample, check_approximate, check_missing_categorical, check_streamed_missing,
+          check_optimistic_estimates, check_ranking_labels, check_admission]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Regression checks of the search")
+    parser.add_argument('--check', nargs='+', default=[check.__name__ for check in CHECKS],
+                        choices=[check.__name__ for check in CHECKS])
+    args = parser.parse_args(argv)
+    failed = 0
+    for check in CHECKS:
+        if check.__name__ not in args.check:
+            continue
+        try:
+            check()
+            print(f"{check.__name__:<30} ok", file=sys.stderr)
+        except AssertionError as e:
+            failed += 1
+            print(f"{check.__name__:<30} FAILED: {e}", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import string
+
+from dataclasses import dataclass
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+@dataclass
+class SyntheticData:
+    data: pd.DataFrame
+    planted: List[dict]  # Per planted subgroup its conditions, e.g. {'c0': 'v1', 'n2': ('>', 0.52)}
+    masks: List[np.ndarray]  # Rows covered by every planted subgroup
+
+def label_names(n_labels: int):
+    if n_labels <= len(string.ascii_lowercase):
+        return list(string.ascii_lowercase[:n_labels])
+    return [f'l{i}' for i in range(n_labels)]
+
+def make_rankings(n_rows: int = 10000, n_labels: int = 5, n_categorical: int = 3, n_numeric: int = 2,
+                  n_integer: int = 1, n_values: int = 4, n_planted: int = 2, planted_depth: int = 2,
+                  noise: float = 1.0, tie_probability: float = 0.1, missing_probability: float = 0.0,
+                  seed: int = 0):
+    """
+    Generate a synthetic ranking dataset with planted exceptional subgroups.
+
+    Every row ranks the labels on a shared base utility plus Gaussian noise. The rows of a
+    planted subgroup, a conjunction of `planted_depth` random conditions on the descriptors,
+    rank on the reversed base utility instead. Adjacent labels of a ranking are tied with
+    probability `tie_probability`, and every label is left out of a ranking with probability
+    `missing_probability` (a ranking keeps at least two labels).
+
+    Parameters:
+        n_rows (int) - Number of rows
+        n_labels (int) - Number of labels, single letters up to 26 labels
+        n_categorical (int) - Number of categorical descriptors `c0, c1, ...` with `n_values` values each
+        n_numeric (int) - Number of float descriptors `n0, n1, ...`
+        n_integer (int) - Number of integer descriptors `i0, i1, ...` with values in [0, 100)
+        n_values (int) - Number of values of a categorical descriptor
+        n_planted (int) - Number of planted subgroups
+        planted_depth (int) - Number of conditions describing a planted subgroup
+        noise (float) - Standard deviation of the noise on the utilities
+        tie_probability (float) - Probability that a label is tied with the previous one
+        missing_probability (float) - Probability that a label is missing from a ranking
+        seed (int) - Seed of the random generator, equal seeds give equal datasets
+
+    Returns:
+        synthetic (SyntheticData) - The dataset, the conditions of the planted subgroups and their row masks
+    """
+    rng = np.random.default_rng(seed)
+    data = dict()
+    for i in range(n_categorical):
+        data[f'c{i}'] = np.array([f'v{k}' for k in range(n_values)])[rng.integers(0, n_values, n_rows)]
+    for i in range(n_numeric):
+        data[f'n{i}'] = rng.normal(size=n_rows).round(2)
+    for i in range(n_integer):
+        data[f'i{i}'] = rng.integers(0, 100, n_rows)
+    if n_planted > 0 and len(data) < planted_depth:
+        raise ValueError("A planted subgroup needs more descriptors than there are")
+
+    base = np.linspace(1, -1, n_labels)
+    utilities = np.tile(base, (n_rows, 1))
+    planted, masks = [], []
+    for _ in range(n_planted):
+        conditions = dict()
+        mask = np.ones(n_rows, dtype=bool)
+        for column in rng.choice(list(data), size=planted_depth, replace=False).tolist():
+            values = data[column]
+            if column.startswith('c'):
+                value = str(values[rng.integers(n_rows)])
+                conditions[column] = value
+                mask &= values == value
+            else:
+                threshold = float(np.quantile(values, 0.5))
+                conditions[column] = ('>', threshold)
+                mask &= values > threshold
+        utilities[mask] = base[::-1]
+        planted.append(conditions)
+        masks.append(mask)
+    utilities = utilities + rng.normal(scale=noise, size=utilities.shape)
+
+    labels = label_names(n_labels)
+    separator = '' if n_labels <= len(string.ascii_lowercase) else '='
+    orders = np.argsort(-utilities, axis=1)
+    ties = rng.random((n_rows, n_labels)) < tie_probability
+    missing = rng.random((n_rows, n_labels)) < missing_probability
+    rankings = []
+    for order, tie, miss in zip(orders, ties, missing):
+        kept = [label for label, m in zip(order, miss[order]) if not m]
+        if len(kept) < 2:
+            kept = list(order[:2])
+        tiers = []
+        for position, label in enumerate(kept):
+            if tiers and tie[position]:
+                tiers[-1].append(labels[label])
+            else:
+                tiers.append([labels[label]])
+        rankings.append('>'.join(separator.join(tier) for tier in tiers))
+
+    data['ranking'] = rankings
+    return SyntheticData(pd.DataFrame(data), planted, masks)
@@ -0,0 +1,127 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generator import make_rankings
+from epm.EPM import EPM
+
+METRICS = ['rw_norm', 'rw_norm_mode', 'rw_cov', 'lw_norm', 'pw_max']
+ALGORITHMS = ['apriori', 'best_first', 'eclat']
+BIN_STRATEGIES = ['equidepth', 'equiwidth']
+
+def search_settings(algorithm: str, metric: str, bin_strategy: str, depth: int, n_jobs: int):
+    settings = dict(depth=depth, evaluation_metric=metric, algorithm=algorithm, bin_strategy=bin_strategy, n_jobs=n_jobs)
+    if algorithm in ('apriori', 'eclat'):
+        settings.update(evaluation_threshold=-0.001 if metric == 'rw_cov' else 0.05, frequency_threshold=0.05)
+    else:
+        settings.update(width=10)
+    return settings
+
+def measure(setup, run, repeat: int):
+    """
+    Wall time (best of `repeat` runs) and peak traced memory (a separate run) of `run(setup())`.
+    """
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        gc.collect()
+        start = time.perf_counter()
+        result = run(state)
+        times.append(time.perf_counter() - start)
+
+    state = setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run(state)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(wall_time=min(times), wall_times=times, peak_memory=peak), result
+
+def benchmark_load(data: pd.DataFrame, repeat: int):
+    results = []
+    timing, _ = measure(lambda: EPM(depth=1, evaluation_metric='rw_norm', width=1, algorithm='best_first'),
+                        lambda clf: clf.load_data(data), repeat)
+    results.append(dict(name='load_data/frame', **timing))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'data.csv')
+        data.to_csv(path, index=False)
+        timing, _ = measure(lambda: EPM(depth=1, evaluation_metric='rw_norm', width=1, algorithm='best_first'),
+                            lambda clf: clf.load_data(path), repeat)
+        results.append(dict(name='load_data/csv_stream', **timing))
+    return results
+
+def benchmark_search(data: pd.DataFrame, algorithm: str, metric: str, bin_strategy: str, depth: int, n_jobs: int,
+                     repeat: int):
+    settings = search_settings(algorithm, metric, bin_strategy, depth, n_jobs)
+
+    def setup():
+        clf = EPM(**settings)
+        clf.load_data(data)
+        return clf
+
+    def run(clf):
+        clf.search()
+        return clf
+
+    timing, clf = measure(setup, run, repeat)
+    return dict(name=f'search/{algorithm}/{metric}/{bin_strategy}', settings=settings, **timing,
+                candidates_evaluated=clf.stats.total.evaluated, subgroups=len(clf.algorithm.subgroups),
+                stats=clf.stats.to_dict())
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return dict(python=platform.python_version(), numpy=np.__version__, pandas=pd.__version__,
+                platform=platform.platform(), cpu_count=os.cpu_count(), commit=commit)
+
+def run_suite(rows: int = 20000, labels: int = 6, depth: int = 2, repeat: int = 3, n_jobs: int = 1, seed: int = 0,
+              algorithms=ALGORITHMS, metrics=METRICS, bin_strategies=BIN_STRATEGIES):
+    dataset = dict(n_rows=rows, n_labels=labels, seed=seed)
+    data = make_rankings(**dataset).data
+    results = benchmark_load(data, repeat)
+    for algorithm in algorithms:
+        for metric in metrics:
+            for bin_strategy in bin_strategies:
+                results.append(benchmark_search(data, algorithm, metric, bin_strategy, depth, n_jobs, repeat))
+    return dict(environment=environment(), dataset=dataset, depth=depth, repeat=repeat, results=results)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark loading and searching synthetic ranking data")
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--labels', type=int, default=6)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--n-jobs', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--algorithm', nargs='+', default=ALGORITHMS, choices=ALGORITHMS)
+    parser.add_argument('--metric', nargs='+', default=METRICS, choices=METRICS)
+    parser.add_argument('--bin-strategy', nargs='+', default=BIN_STRATEGIES, choices=BIN_STRATEGIES)
+    parser.add_argument('--output', help="JSON file for the results, printed when not given")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.rows, args.labels, args.depth, args.repeat, args.n_jobs, args.seed,
+                       args.algorithm, args.metric, args.bin_strategy)
+    for result in report['results']:
+        print(f"{result['name']:<45} {result['wall_time']:8.3f} s {result['peak_memory'] / 1024 ** 2:9.1f} MB "
+              f"{result.get('candidates_evaluated', ''):>8}", file=sys.stderr)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
@@ -1,28 +1,47 @@
 import logging
 
-from typing import List, Optional
+import os
+
+from typing import Callable, Iterable, List, Optional, Tuple, Union
 
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 
-from epm.util import downsize
+from epm.dataset import Dataset, content_key, load_cached
 from epm.subgroup import Subgroup
 from epm.description import Description
-from epm.metrics import metrics
-from epm.preference_matrix import ranking_to_preference_matrix, aggregate_preference_matrix, distance_matrix
+from epm.metrics import metrics, batch_metrics, optimistic_estimates, score_bounds
+from epm.preference_matrix import PreferenceStats, distance_matrix
 from epm.algorithm import Algorithm
+from epm.backend import get_backend
+from epm.evaluation_cache import EvaluationCache
+from epm.stats import DepthStats, SearchStats
+from epm.sampling import stratified_sample
+from epm.selector_index import SelectorIndex
+from epm.sweep import Sweep
 
 class EPM:
-    def __init__(self, depth: int, evaluation_metric: str, evaluation_threshold: float = None, frequency_threshold: float = None,
+    def __init__(self, depth: int, evaluation_metric: Union[str, Callable], evaluation_threshold: float = None, frequency_threshold: float = None,
                  width: int = None, bin_subgroups = 'both', candidate_size: int = None, algorithm: str = 'apriori',
-                 n_bins: int = 8, bin_strategy: Optional[str] = 'equidepth', log_level=50):
+                 n_bins: int = 8, bin_strategy: Optional[str] = 'equidepth', n_jobs: int = 1,
+                 evaluation_cache: EvaluationCache = None, stats_callback: Callable[[DepthStats], None] = None,
+                 time_budget: float = None, memory_budget: int = None, sample_fraction: float = 0.1,
+                 confidence: float = 0.99, backend: str = 'numpy', log_level=50):
         logging.basicConfig(filename=None, level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
-        try:
-            self.evaluation_function = metrics[evaluation_metric]
-        except KeyError:
-            raise ValueError(f"No such metric: {evaluation_metric}")
+        if callable(evaluation_metric):
+            # Custom quality measure, evaluated one subgroup at a time
+            self.evaluation_function = evaluation_metric
+            self.batch_evaluation_function = None
+            self.optimistic_estimate = None
+        else:
+            try:
+                self.evaluation_function = metrics[evaluation_metric]
+                self.batch_evaluation_function = batch_metrics[evaluation_metric]
+                self.optimistic_estimate = optimistic_estimates[evaluation_metric]
+            except KeyError:
+                raise ValueError(f"No such metric: {evaluation_metric}")
         
         if evaluation_metric == 'rw_cov':
             strategy = 'minimize'
@@ -38,13 +57,13 @@ class EPM:
         else:
             aggregate_technique = 'mean'
 
-        if algorithm != 'apriori' and algorithm != 'best_first':
+        if algorithm not in ('apriori', 'best_first', 'eclat'):
             raise ValueError(f"Invalid algorithm: {algorithm}")
         
-        if algorithm == 'apriori' and (candidate_size is not None or width is not None):
-            raise ValueError("A limit on candidate size and width are not allowed for apriori algorithm")
-        elif algorithm == 'apriori' and (evaluation_threshold is None or frequency_threshold is None):
-            raise ValueError("Evaluation and frequency threshold should be specified for apriori algorithm")
+        if algorithm in ('apriori', 'eclat') and (candidate_size is not None or width is not None):
+            raise ValueError(f"A limit on candidate size and width are not allowed for {algorithm} algorithm")
+        elif algorithm in ('apriori', 'eclat') and (evaluation_threshold is None or frequency_threshold is None):
+            raise ValueError(f"Evaluation and frequency threshold should be specified for {algorithm} algorithm")
         elif algorithm == 'best_first' and frequency_threshold is not None:
             raise ValueError("Frequency threshold is not allowed for best_first algorithm")
         elif algorithm == 'best_first' and width is None and evaluation_threshold is None:
@@ -61,37 +80,200 @@ class EPM:
             bin_subgroups=bin_subgroups,
             candidate_size=candidate_size,
             aggregate_technique=aggregate_technique,
-            depth=depth
+            depth=depth,
+            n_jobs=n_jobs,
+            evaluation_metric=evaluation_metric if isinstance(evaluation_metric, str) else None,
+            time_budget=time_budget,
+            memory_budget=memory_budget,
+            sample_fraction=sample_fraction,
+            confidence=confidence,
+            backend=get_backend(backend).name  # Resolved once, the pool processes get the same backend
         )
+        self.evaluation_cache = evaluation_cache
+        self.stats_callback = stats_callback
 
+        self.data = None
         self.dataset = None
         self.algorithm = None
         self.unique_labels = None
+        self.preferences = None
+        self.index = None
+        self.descriptive_cols = None
+        self.sample = None
+
+    def load_data(self, data: Union[pd.DataFrame, str, Iterable[pd.DataFrame]], chunksize: int = 100000,
+                  directory: str = None, labels: List[str] = None, cache_dir: str = None):
+        """
+        Load the dataset to mine. A DataFrame is encoded in memory, a CSV path or an iterator of
+        DataFrame chunks is streamed into memory-mapped arrays (in `directory`, a temporary
+        directory when not given) so the dataset does not have to fit in memory.
+
+        With a `cache_dir`, the encoded dataset of a DataFrame or CSV file is stored there under a
+        hash of its contents, and later loads of the same data map the stored arrays instead.
+        """
+        def build():
+            if isinstance(data, pd.DataFrame):
+                logging.info("Loading data...")
+                return Dataset.from_frame(data, labels)
+            logging.info("Streaming data...")
+            chunks = pd.read_csv(data, chunksize=chunksize) if isinstance(data, (str, os.PathLike)) else data
+            return Dataset.from_chunks(chunks, directory, labels)
+
+        if cache_dir is not None and isinstance(data, (pd.DataFrame, str, os.PathLike)):
+            self.prepare(load_cached(cache_dir, content_key(data, labels), build))
+        else:
+            if cache_dir is not None:
+                logging.warning("Only DataFrames and CSV files are cached, loading the chunks without cache")
+            self.prepare(build())
+
+    def prepare(self, data: Dataset, index: SelectorIndex = None):
+        """
+        Search the encoded dataset `data`. An `index` built before on the same data with the same
+        binning settings is reused instead of discretizing the descriptive columns again.
+        """
+        self.data = data
+        self.settings['object_cols'] = data.translations
+        self.descriptive_cols = None
+        # Discretize the descriptive columns and index the rows of every selector
+        self.index = SelectorIndex(data, self.settings) if index is None else index
+        self.prepare_algorithm()
+
+    def prepare_algorithm(self):
+        self.preferences, self.unique_labels = self.data.preferences, self.data.labels
+
+        stats_d = self.data.stats
+        matrix_d = stats_d.aggregate(self.settings['aggregate_technique'])
+
+        self.dataset = Subgroup(data=self.data, description=Description('all'), pm=matrix_d, stats=stats_d)
+
+        self.algorithm = Algorithm(self.settings, self.dataset, self.evaluation_function, self.preferences, self.index,
+                                   self.batch_evaluation_function, self.optimistic_estimate, self.evaluation_cache,
+                                   self.stats_callback)
+        self.sample = None
+
+    def append_data(self, data: pd.DataFrame, research: bool = True):
+        """
+        Add new rows to the loaded dataset, encoding only the new rows.
+
+        The dataset preference matrix and the selector index are updated with the new rows. The bins of
+        the first load are kept, so the descriptions found before stay valid. With an evaluation cache,
+        the cached descriptions are carried over to the grown dataset by adding the new rows they cover
+        to their statistics.
+
+        After a search, `research` runs that search again, which only aggregates the new rows of the
+        descriptions in the evaluation cache. Without it, the subgroups found before are updated with the
+        new rows they cover, scored again and re-ranked, without looking for new subgroups.
+        """
+        if self.data is None:
+            raise ValueError("Load a dataset before appending rows")
+        start = len(self.data)
+        previous = self.algorithm
+        translation = self.settings['object_cols']
+        subgroups = []
+        for subgroup in previous.subgroups:
+            if 'all' in subgroup.description:
+                continue
+            subgroups.append(Subgroup(self.data, subgroup.description.encrypt(translation), pm=subgroup.pm, coverage=subgroup.coverage,
+                                      stats=subgroup.stats, rows=subgroup.rows))
+
+        logging.info(f"Appending {len(data)} rows...")
+        self.data.append(data)
+        self.index.append(self.data, start)
+        self.prepare_algorithm()
 
-    def load_data(self, data: pd.DataFrame):
-        logging.info("Loading data...")
-        df, translations = downsize(data.copy(deep=True))
-        self.settings['object_cols'] = translations
+        if self.evaluation_cache is not None:
+            def update(key, stats: PreferenceStats):
+                added = self.index.select(self.data, dict(key), start)
+                return stats + PreferenceStats.from_tensor(self.preferences[start + np.flatnonzero(added)])
+            self.evaluation_cache.rebase(previous.fingerprint, self.algorithm.fingerprint, update)
 
-        # Generate preference matrices
-        self.unique_labels = sorted(set(filter(str.isalpha, df['ranking'].iloc[0]))) # Assuming each row contains all labels
-        df['PM'] = df['ranking'].apply(lambda x: ranking_to_preference_matrix(x, self.unique_labels))
+        if self.descriptive_cols is None:
+            return
+        if research:
+            self.search(self.descriptive_cols)
+        else:
+            self.algorithm.refresh(subgroups, start)
+            self.algorithm.decrypt_descriptions(translation)
+            self.algorithm.print()
 
-        matrix_d = aggregate_preference_matrix(list(df['PM']), self.settings['aggregate_technique'])
+    @property
+    def stats(self) -> SearchStats:
+        # Per depth timings and counters of the last search
+        return self.algorithm.stats if self.algorithm is not None else None
 
-        self.dataset = Subgroup(data=df, description=Description('all'), pm=matrix_d)
-        self.algorithm = Algorithm(self.settings, self.dataset, self.evaluation_function)
+    @property
+    def truncated(self) -> bool:
+        # Whether the last search stopped early on its time or memory budget
+        return self.algorithm is not None and self.algorithm.truncated
 
-    def search(self, descriptive_cols: List[str] = None):
+    def search(self, descriptive_cols: List[str] = None, approximate: bool = False):
+        """
+        Run the search. With `approximate`, candidates are scored on a sample of the rows stratified on
+        the ranking (`sample_fraction`), and only the candidates of which the confidence interval of the
+        score (at level `confidence`) reaches the evaluation threshold or the candidate queue are
+        evaluated exactly on all rows. The scores of the subgroups found are exact.
+        """
         logging.info("Start")
-        if descriptive_cols is None:
-            descriptive_cols = [c for c in self.dataset.data.columns if c != 'ranking' and c != 'PM']
-        if any(c not in self.dataset.data.columns for c in descriptive_cols):
-            raise ValueError("All specified descriptive columns should be present in the dataset")
+        descriptive_cols = self.descriptive_cols = self.check_columns(descriptive_cols)
+        self.approximate(approximate)
         self.algorithm.run(descriptive_cols)
         self.algorithm.decrypt_descriptions(self.settings['object_cols'])
         self.algorithm.print()
 
+    def search_iter(self, descriptive_cols: List[str] = None, approximate: bool = False):
+        """
+        Run the search, yielding the subgroups that enter the candidate queue while they are found.
+
+        The yielded subgroups are copies with decrypted descriptions. When the generator is exhausted
+        the result is in `algorithm.subgroups` as after `search`, and `truncated` tells whether a budget
+        stopped the search early.
+        """
+        logging.info("Start")
+        descriptive_cols = self.descriptive_cols = self.check_columns(descriptive_cols)
+        self.approximate(approximate)
+        for improvements in self.algorithm.steps(descriptive_cols, track_improvements=True):
+            for subgroup in improvements:
+                yield subgroup.decrypted(self.settings['object_cols'])
+        self.algorithm.decrypt_descriptions(self.settings['object_cols'])
+        self.algorithm.print()
+
+    def sweep(self, configs: List[Tuple[str, float, float, int]], descriptive_cols: List[str] = None):
+        """
+        Run an apriori search for every (metric, evaluation_threshold, frequency_threshold, depth) configuration
+        at the cost of about one search.
+
+        The candidate lattice is generated and aggregated once, at the lowest frequency threshold and the
+        largest depth, and every metric is scored once per candidate. The binning settings of this EPM are
+        used, its own metric, thresholds and algorithm are not.
+
+        Returns:
+            results (List[List[Subgroup]]) - Per configuration the subgroups found, best first
+        """
+        logging.info("Start sweep")
+        descriptive_cols = self.check_columns(descriptive_cols)
+        sweep = Sweep(self.settings, self.dataset, self.preferences, self.index, configs, self.evaluation_cache)
+        sweep.run(descriptive_cols)
+        return [sweep.results(config, self.settings['object_cols']) for config in sweep.configs]
+
+    def approximate(self, approximate: bool):
+        if not approximate:
+            self.algorithm.approximate(None, None)
+            return
+        if self.settings['evaluation_metric'] not in score_bounds:
+            raise ValueError(f"An approximate search is only possible with the metrics {', '.join(score_bounds)}")
+        if self.sample is None:
+            # Drawn once, later approximate searches on the same data use the same sample
+            self.sample = stratified_sample(self.preferences, self.settings['sample_fraction'])
+            logging.info(f"Sampled {self.sample.count} of {len(self.data)} rows")
+        self.algorithm.approximate(self.sample, score_bounds[self.settings['evaluation_metric']])
+
+    def check_columns(self, descriptive_cols: List[str] = None):
+        if descriptive_cols is None:
+            descriptive_cols = self.data.column_names
+        if any(c not in self.data.column_names for c in descriptive_cols):
+            raise ValueError("All specified descriptive columns should be present in the dataset")
+        return descriptive_cols
+
     def visualise(self, subgroups_amount: int = None):
         if subgroups_amount is None:
             subgroups_amount = len(self.algorithm.subgroups)
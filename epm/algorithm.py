@@ -1,21 +1,35 @@
-from copy import deepcopy
-import pandas as pd
+import numpy as np
 
 import logging
+import os
+
+from time import perf_counter
 
 from typing import List
 
+from epm.backend import get_backend
+from epm.bitset import Bitset
+from epm.candidates import CandidateQueue
 from epm.subgroup import Subgroup
-from epm.description import Description
-from epm.preference_matrix import aggregate_preference_matrix
+from epm.description import Description, DescriptionRegistry
+from epm.preference_matrix import IntervalStats, PreferenceStats
+from epm.sampling import half_widths
+from epm.stats import DepthStats, SearchStats, current_memory
 
 class Algorithm:
-    def __init__(self, settings, dataset, evaluation_function):
+    batch_size = 4096  # Maximum number of candidates evaluated in one batch
+
+    def __init__(self, settings, dataset, evaluation_function, preferences, index, batch_evaluation_function=None,
+                 optimistic_estimate=None, evaluation_cache=None, stats_callback=None):
         self.settings = settings
         self.dataset = dataset
+        self.preferences = preferences
+        self.index = index
         self.evaluation_function = evaluation_function
+        self.batch_evaluation_function = batch_evaluation_function
+        self.optimistic_estimate = optimistic_estimate
+        self.pending = []
         self.subgroups = [dataset]
-        self.candidates = []
         self.items = 1
         self.evaluation_threshold = settings['evaluation_threshold']
         self.frequency_threshold = settings['frequency_threshold']
@@ -29,180 +43,497 @@ class Algorithm:
             else:
                 self.candidate_size = self.width ** 2
         self.strategy = settings['strategy']
-        self.worst_score = None
-        self.scores = []
+        self.candidates = CandidateQueue(self.strategy, self.candidate_size if self.algorithm == 'best_first' else None)
         self.depth = settings['depth']
-        self.constructed_descriptions = []
+        self.constructed_descriptions = DescriptionRegistry()
         self.current_depth = None
         self.frequent_itemset = []
-        self.intervals_list = []
+        n_jobs = settings.get('n_jobs', 1)
+        self.n_jobs = os.cpu_count() if n_jobs is None or n_jobs < 0 else n_jobs
+        self.refiner = None
+        self.stats = SearchStats()
+        self.depth_stats = DepthStats()
+        self.stats_callback = stats_callback
+        self.evaluation_cache = evaluation_cache
+        self.fingerprint = dataset.source.fingerprint if evaluation_cache is not None else None
+        self.metric = settings.get('evaluation_metric')  # None for a custom evaluation function
+        self.time_budget = settings.get('time_budget')
+        self.memory_budget = settings.get('memory_budget')
+        self.truncated = False
+        self.start_time = None  # Set when a search starts
+        self.improvements = None
+        self.sample = None  # Rows the candidates are estimated on in an approximate search
+        self.parents = dict()
+        self.score_bounds = None
+        self.confidence = settings.get('confidence', 0.99)
+        self.backend = get_backend(settings.get('backend', 'numpy'))
 
     def run(self, descriptive_cols: List[str]):
+        for _ in self.steps(descriptive_cols):
+            pass
+
+    def steps(self, descriptive_cols: List[str], track_improvements: bool = False):
+        """
+        Run the search, yielding at every checkpoint (after a parent subgroup or a batch of candidates)
+        the list of subgroups that entered the candidate queue since the previous checkpoint (only
+        collected when `track_improvements`). When the time or memory budget is exhausted the search
+        stops at a checkpoint, selects the best candidates found so far and sets `truncated`.
+        """
+        # Every search starts from the whole dataset
+        self.subgroups = [self.dataset]
+        self.candidates = CandidateQueue(self.strategy, self.candidate_size if self.algorithm == 'best_first' else None)
+        self.constructed_descriptions = DescriptionRegistry()
+        self.frequent_itemset = []
+        self.stats = SearchStats()
         self.current_depth = 0
-        while self.current_depth < self.depth:
-            self.increase_depth(descriptive_cols)
-            self.current_depth += 1
+        self.truncated = False
+        self.improvements = [] if track_improvements else None
+        self.start_time = perf_counter()
+        if self.n_jobs > 1 and self.algorithm != 'eclat' and self.sample is None:
+            from epm.parallel import ParallelRefiner  # epm.parallel depends on Algorithm
+            self.refiner = ParallelRefiner(self, self.n_jobs)
+        try:
+            while self.current_depth < self.depth_steps:
+                self.depth_stats = DepthStats(self.current_depth + 1)
+                start = perf_counter()
+                checkpoints = self.increase_depth(descriptive_cols)
+                for _ in checkpoints:
+                    if self.out_of_budget():
+                        self.truncated = True
+                        break
+                    yield self.take_improvements()
+                checkpoints.close()
+                if self.truncated:
+                    # Keep the best candidates found so far
+                    self.evaluate_pending()
+                    self.select_candidates()
+                self.depth_stats.finish(perf_counter() - start)
+                self.stats.depths.append(self.depth_stats)
+                logging.info(f"Depth {self.current_depth + 1}: {len(self.constructed_descriptions)} descriptions constructed, "
+                             f"{self.constructed_descriptions.hits[self.current_depth]} duplicates skipped")
+                if self.stats_callback is not None:
+                    self.stats_callback(self.depth_stats)
+                if self.truncated:
+                    logging.info(f"Budget exhausted at depth {self.current_depth + 1}, keeping the best subgroups found so far")
+                    break
+                self.current_depth += 1
+            yield self.take_improvements()
+        finally:
+            if self.refiner is not None:
+                # A search stopped on its budget does not wait for the tasks still running
+                self.refiner.close(wait=not self.truncated)
+                self.refiner = None
+
+    def approximate(self, sample: Bitset, score_bounds):
+        """
+        Estimate the candidates of the following searches on a sample of the rows, or evaluate them exactly
+        again when `sample` is None. Only the candidates of which the confidence interval of the score,
+        given by `score_bounds`, reaches the evaluation threshold or the candidate queue are evaluated exactly.
+        """
+        self.sample = sample
+        self.score_bounds = score_bounds
+
+    @property
+    def depth_steps(self):
+        # Eclat runs the whole depth-first search in a single step
+        return 1 if self.algorithm == 'eclat' else self.depth
+
+    def out_of_budget(self):
+        if self.time_budget is not None and perf_counter() - self.start_time > self.time_budget:
+            return True
+        if self.memory_budget is not None:
+            # The current memory, the peak of the process may stem from earlier work
+            memory = current_memory()
+            return memory is not None and memory > self.memory_budget
+        return False
+
+    def take_improvements(self):
+        if self.improvements is None:
+            return []
+        improvements, self.improvements = self.improvements, []
+        return improvements
 
     def increase_depth(self, descriptive_cols: List[str]):
+        # Generator, yields at the checkpoints of the depth step
         if len(self.subgroups) == 0:
                 return
         if self.algorithm == 'best_first':
-            for subgroup in self.subgroups:
-                for col in descriptive_cols:
-                    self.create_subgroups(subgroup, col)
+            yield from self.refine(self.subgroups, descriptive_cols)
             self.select_candidates()
         elif self.algorithm == 'apriori':
             if self.current_depth == 0:
-                for subgroup in self.subgroups:
-                    for col in descriptive_cols:
-                        self.create_subgroups(subgroup, col)
+                yield from self.refine(self.subgroups, descriptive_cols)
             else:
-                previous_freq_itemset = deepcopy(self.frequent_itemset)
+                previous_freq_itemset = self.frequent_itemset
                 self.frequent_itemset = []
-                for i, item1 in enumerate(previous_freq_itemset):
-                    for j in range(i + 1, len(previous_freq_itemset)):
-                        item2 = previous_freq_itemset[j]
-                        self.merge_subgroups(item1, item2)
+                yield from self.join(previous_freq_itemset)
             # If in the last iteration, select the candidates (candidates -> subgroups)
             if self.current_depth == self.depth - 1:
                 self.select_candidates()
+        elif self.algorithm == 'eclat':
+            self.frequent_itemset = []
+            yield from self.refine(self.subgroups, descriptive_cols)
+            yield from self.eclat(self.frequent_itemset, 1)
+            self.evaluate_pending()
+            self.select_candidates()
     
-    def merge_subgroups(self, subgroup1: Subgroup, subgroup2: Subgroup):
-        # Check whether subgroup1.description and subgroup2.description do not overlap
-        overlap = set(subgroup1.description.description.keys()) & set(subgroup2.description.description.keys())
+    def prune(self, subgroup: Subgroup):
+        # Branch-and-bound: skip a subgroup when no refinement can pass the threshold or enter the full candidate queue
+        if self.optimistic_estimate is None:
+            return False
+        bound = self.optimistic_estimate(self.dataset, subgroup)
+        limits = []
+        if self.evaluation_threshold is not None:
+            limits.append(self.evaluation_threshold)
+        if self.candidates.full:
+            limits.append(self.candidates.worst_score)
+        if self.strategy == 'maximize':
+            pruned = any(bound <= limit for limit in limits)
+        else:
+            pruned = any(bound >= limit for limit in limits)
+        if pruned:
+            self.depth_stats.pruned += 1
+            logging.debug(f"Pruning subgroup with description: {str(subgroup.description)}, optimistic estimate {bound}")
+        return pruned
 
-        for col in overlap:
-            if subgroup1.description.description[col] != subgroup2.description.description[col]:
-                return
-        
-        if len(overlap) != (self.current_depth - 1):
+    def refine(self, parents: List[Subgroup], descriptive_cols: List[str]):
+        if self.refiner is not None:
+            if self.algorithm == 'best_first':
+                parents = [subgroup for subgroup in parents if not self.prune(subgroup)]
+            for refined in self.refiner.refine(parents, descriptive_cols):
+                for subgroup in refined:
+                    self.add_refined(subgroup)
+                yield
+        else:
+            for subgroup in parents:
+                if self.algorithm == 'best_first' and self.prune(subgroup):
+                    continue
+                for col in descriptive_cols:
+                    self.create_subgroups(subgroup, col)
+                yield
+            self.evaluate_pending()
+            yield
+
+    def join(self, itemsets: List[Subgroup]):
+        if self.refiner is not None:
+            for refined in self.refiner.join(itemsets, list(self.join_candidates(itemsets))):
+                for subgroup in refined:
+                    self.add_refined(subgroup)
+                yield
+        else:
+            for i, j, new_desc in self.join_candidates(itemsets):
+                self.merge_subgroups(itemsets[i], itemsets[j], new_desc)
+                yield
+            self.evaluate_pending()
+            yield
+
+    def eclat(self, itemsets: List[Subgroup], size: int):
+        # Depth-first: an itemset is joined with its siblings (sharing all but the last item) on a later attribute,
+        # and the subtree of its frequent extensions is completed before the next sibling is visited. Every
+        # candidate apriori-gen would join is generated once, and only the itemsets on the current path are kept.
+        if size >= self.depth:
             return
+        for item in itemsets:
+            attribute = item.description.key[-1][0]
+            self.frequent_itemset = []
+            for other in itemsets:
+                if other.description.key[-1][0] <= attribute:
+                    continue
+                new_desc = item.description.merge(other.description)
+                self.merge_subgroups(item, other, new_desc)
+            extensions = self.frequent_itemset
+            yield
+            yield from self.eclat(extensions, size + 1)
+
+    def join_candidates(self, itemsets: List[Subgroup]):
+        # Apriori-gen: only itemsets sharing their first k-1 items (sorted on attribute) are joined,
+        # so every candidate of the next level is generated exactly once
+        frequent_keys = {item.description.key for item in itemsets}
+        siblings = dict()
+        for index, item in enumerate(itemsets):
+            siblings.setdefault(item.description.key[:-1], []).append(index)
+        for group in siblings.values():
+            for position, i in enumerate(group):
+                for j in group[position + 1:]:
+                    if itemsets[i].description.key[-1][0] == itemsets[j].description.key[-1][0]:
+                        continue
+                    new_desc = itemsets[i].description.merge(itemsets[j].description)
 
-        subset = pd.merge(subgroup1.data, subgroup2.data, how='inner')
-        if len(subset) == 0:
+                    # A candidate with an infrequent subset can not be frequent itself
+                    key = new_desc.key
+                    if any(key[:k] + key[k + 1:] not in frequent_keys for k in range(len(key))):
+                        continue
+                    yield i, j, new_desc
+
+    def merge_subgroups(self, subgroup1: Subgroup, subgroup2: Subgroup, new_desc: Description):
+        rows = subgroup1.rows & subgroup2.rows
+        if rows.count == 0:
             return
-        
-        new_desc = Description(None, dictionary=subgroup1.description.description)
-        new_desc.merge(subgroup2.description)
-        self.check_for_duplicates_and_add(new_desc, subset)
+        self.check_for_duplicates_and_add(new_desc, rows, subgroup1)
 
     def create_subgroups(self, subgroup: Subgroup, column: str):
         if column in subgroup.description:
             return
-        data = subgroup.data
-        values = list(data[column].unique())
-        if len(values) == 1:  # No need to make a split for a single value
+        selectors = self.index[column]
+        if selectors.kind == 'categorical':
+            self.create_subgroups_categorical(subgroup, column, selectors)
+        elif not selectors.single_valued(subgroup.rows):  # No need to make a split for a single value
+            self.create_subgroups_numerical(subgroup, column, selectors)
+
+    def create_subgroups_categorical(self, subgroup, column, selectors):
+        children = [(value, subgroup.rows & mask) for value, mask in zip(selectors.values, selectors.masks)]
+        children = [(value, rows) for value, rows in children if rows.count > 0]
+        if len(children) == 1:  # No need to make a split for a single value
             return
-        if column in self.settings['object_cols'] or len(values) < self.settings['n_bins']:
-            self.create_subgroups_categorical(subgroup, column, data, values)
-        else:  # Float or Int
-            self.create_subgroups_numerical(subgroup, column, data)
-
-    def create_subgroups_categorical(self, subgroup, column, data, values):
-        while len(values) > 0: # Reasonable size to keep in the beam
-            value = values.pop(0)
-            subset = data[data[column] == value]
-            if len(subset) == 0:
-                continue
-            new_desc = deepcopy(subgroup.description).extend(column, value)
-            self.check_for_duplicates_and_add(new_desc, subset)
-
-    def create_subgroups_numerical(self, subgroup, column, data):
-        if (self.intervals_list == []):
-            if self.settings['bin_strategy'] == 'equidepth':
-                _, intervals = pd.qcut(data[column].tolist(), q=self.settings['n_bins'],
-                                        duplicates='drop', retbins=True)
-            elif self.settings['bin_strategy'] == 'equiwidth':
-                _, intervals = pd.cut(data[column].tolist(), bins=self.settings['n_bins'],
-                                        duplicates='drop', retbins=True)
+        # Values in order of appearance within the subgroup
+        children.sort(key=lambda child: child[1].first())
+        for value, rows in children:
+            new_desc = subgroup.description.extend(column, value)
+            self.check_for_duplicates_and_add(new_desc, rows, subgroup)
+
+    def create_subgroups_numerical(self, subgroup, column, selectors):
+        # The statistics of every bin and split follow from one pass over the rows of the subgroup
+        start = perf_counter()
+        indices = subgroup.rows.indices()
+        interval_stats = IntervalStats(self.preferences, indices, selectors.data[indices], selectors.edges,
+                                       self.backend)
+        self.depth_stats.aggregation += perf_counter() - start
+        self.create_subgroups_bins(subgroup, column, selectors.bins, interval_stats)
+        self.create_subgroups_splits(subgroup, column, selectors.splits, interval_stats)
+
+    def create_subgroups_bins(self, subgroup, column, bins, interval_stats):
+        lower_bound, mask = None, None
+        for lower, upper_bound, bin_mask in bins:
+            # An empty bin is merged into the next one
+            if mask is None:
+                lower_bound, mask = lower, bin_mask
             else:
-                raise ValueError(f"Invalid bin strategy `{self.settings['strategy']}`")
-            
-            self.intervals_list = list(intervals)
-
-        if self.settings['bin_subgroups'] == 'both' or self.settings['bin_subgroups'] == 'per_bin':
-            self.create_subgroups_bins(subgroup, column, data, self.intervals_list)
-        if self.settings['bin_subgroups'] == 'both' or self.settings['bin_subgroups'] == 'per_split':
-            self.create_subgroups_splits(subgroup, column, data, self.intervals_list)
-
-    def create_subgroups_bins(self, subgroup, column, data, intervals_list):
-        intervals = deepcopy(intervals_list)
-        if self.settings['bin_subgroups'] == 'both':
-            intervals.pop(0)
-            intervals.pop(-1)
-        lower_bound = intervals.pop(0)
-        while len(intervals) > 0:
-            upper_bound = intervals.pop(0)
-            subset = data[(data[column] > lower_bound) & (data[column] <= upper_bound)]
-            if len(subset) == 0:
+                mask = mask | bin_mask
+            rows = subgroup.rows & mask
+            if rows.count == 0:
                 continue
-            new_desc = deepcopy(subgroup.description).extend(column, [lower_bound, upper_bound])
-            self.check_for_duplicates_and_add(new_desc, subset)
-            lower_bound = upper_bound
-
-    def create_subgroups_splits(self, subgroup, column, data, intervals_list):
-        intervals = deepcopy(intervals_list)
-        for interval in intervals[1:-1]:
-            subset = data[data[column] >= interval]
-            if len(subset) != 0:
-                new_desc = deepcopy(subgroup.description).extend(column, [interval, None])
-                self.check_for_duplicates_and_add(new_desc, subset)
-            subset = data[data[column] <= interval]
-            if len(subset) != 0:
-                new_desc = deepcopy(subgroup.description).extend(column, [None, interval])
-                self.check_for_duplicates_and_add(new_desc, subset)
-
-    def check_for_duplicates_and_add(self, new_desc, subset):
+            new_desc = subgroup.description.extend(column, (lower_bound, upper_bound))
+            self.check_for_duplicates_and_add(new_desc, rows, subgroup, interval_stats(lower_bound, upper_bound))
+            mask = None
+
+    def create_subgroups_splits(self, subgroup, column, splits, interval_stats):
+        for interval, greater_mask, less_mask in splits:
+            rows = subgroup.rows & greater_mask
+            if rows.count != 0:
+                new_desc = subgroup.description.extend(column, (interval, None))
+                self.check_for_duplicates_and_add(new_desc, rows, subgroup, interval_stats(interval, None))
+            rows = subgroup.rows & less_mask
+            if rows.count != 0:
+                new_desc = subgroup.description.extend(column, (None, interval))
+                self.check_for_duplicates_and_add(new_desc, rows, subgroup, interval_stats(None, interval))
+
+    def subset_stats(self, parent: Subgroup, rows: Bitset):
+        if rows.count * 2 <= parent.size:
+            return self.backend.count(self.preferences, rows)
+        # Cheaper to count the rows of the parent that are left out and subtract them
+        return parent.stats - self.backend.count(self.preferences, parent.rows - rows)
+
+    def check_for_duplicates_and_add(self, new_desc, rows: Bitset, parent: Subgroup, stats: PreferenceStats = None):
+        # Statistics of the rows can be given when they are already known
+        depth_stats = self.depth_stats
+        depth_stats.generated += 1
         try:
-            if not new_desc.description in self.constructed_descriptions:
-                self.constructed_descriptions.append(new_desc.description)
-                if self.algorithm== 'best_first':
-                    pm = aggregate_preference_matrix(list(subset['PM']), self.settings['aggregate_technique'])
-                    subgroup = Subgroup(subset, new_desc, pm=pm)
-                    subgroup.score = self.evaluation_function(self.dataset, subgroup)
-                elif self.algorithm == 'apriori':
-                    coverage = len(subset) / len(self.dataset.data)
-                    if coverage < self.frequency_threshold:
-                        return
-                    pm = aggregate_preference_matrix(list(subset['PM']), self.settings['aggregate_technique'])
-                    subgroup = Subgroup(subset, new_desc, pm=pm, coverage=coverage)
-                    subgroup.score = self.evaluation_function(self.dataset, subgroup)
-                    self.frequent_itemset.append(subgroup)
-                if self.evaluation_threshold is not None:
-                    if (self.strategy == 'maximize' and subgroup.score > self.evaluation_threshold) or \
-                    (self.strategy == 'minimize' and subgroup.score < self.evaluation_threshold):
-                        self.add_subgroup(subgroup)
+            # Eclat generates every description once, registering them would keep all of them in memory
+            if self.algorithm != 'eclat':
+                start = perf_counter()
+                constructed = self.constructed_descriptions.add(new_desc, self.current_depth)
+                depth_stats.dedupe += perf_counter() - start
+                if not constructed:
+                    depth_stats.duplicates += 1
+                    return
+            coverage = rows.count / self.dataset.size
+            if self.algorithm != 'best_first' and coverage < self.frequency_threshold:
+                depth_stats.frequency_dropped += 1
+                return
+            start = perf_counter()
+            entry = None
+            if self.evaluation_cache is not None:
+                entry = self.evaluation_cache.get(self.cache_key(new_desc))
+            estimate = None
+            if entry is not None:
+                stats, pm = entry.stats, entry.pm
+            elif stats is not None:
+                pm = stats.aggregate(self.settings['aggregate_technique'])
+            elif self.sample is not None:
+                sampled = rows & self.sample
+                stats = self.backend.count(self.preferences, sampled)
+                pm = stats.aggregate(self.settings['aggregate_technique'])
+                if sampled.count < rows.count:
+                    stats, estimate = None, stats
+            else:
+                stats = self.subset_stats(parent, rows)
+                pm = stats.aggregate(self.settings['aggregate_technique'])
+            depth_stats.aggregation += perf_counter() - start
+            subgroup = Subgroup(self.dataset.source, new_desc, pm=pm, coverage=coverage, stats=stats, rows=rows)
+            subgroup.estimate = estimate
+            if estimate is not None:
+                self.parents[id(subgroup)] = parent  # Verified from the statistics of the parent when known
+            if entry is not None:
+                subgroup.score = entry.scores.get(self.metric)
+            if self.algorithm == 'eclat':
+                # Frequent extensions of the itemset being visited, the thresholds are applied on evaluation
+                self.frequent_itemset.append(subgroup)
+            self.pending.append(subgroup)
+            if len(self.pending) >= self.batch_size:
+                self.evaluate_pending()
         except:
+            depth_stats.errors += 1
             logging.debug(f"Skipping subgroup with description: {str(new_desc)} due to comparison error")
 
+    def evaluate_pending(self):
+        # Score the collected candidates in one call and pass them on in the order they were generated
+        pending, self.pending = self.pending, []
+        start = perf_counter()
+        self.score(pending)
+        if self.sample is not None:
+            self.verify(pending)
+        self.depth_stats.evaluation += perf_counter() - start
+        for subgroup in pending:
+            self.remember(subgroup)
+            self.admit(subgroup)
+
+    def score(self, subgroups: List[Subgroup]):
+        # Subgroups with a score from the evaluation cache are skipped
+        subgroups = [s for s in subgroups if s.score is None]
+        if len(subgroups) == 0:
+            return
+        if self.batch_evaluation_function is not None:
+            scores = self.batch_evaluation_function(self.dataset.pm.pm, np.stack([s.pm.pm for s in subgroups]),
+                                                    np.array([s.size for s in subgroups]), self.dataset.size)
+        else:
+            scores = [self.evaluation_function(self.dataset, s) for s in subgroups]
+        for subgroup, score in zip(subgroups, scores):
+            subgroup.score = score
+
+    def verify(self, subgroups: List[Subgroup]):
+        # Evaluate the estimated subgroups exactly, unless their confidence interval keeps them out of the candidates
+        estimated = [s for s in subgroups if s.estimate is not None]
+        if len(estimated) == 0:
+            return
+        widths = np.stack([half_widths(s.estimate, self.confidence) for s in estimated])
+        lower, upper = self.score_bounds(self.dataset.pm.pm, np.stack([s.pm.pm for s in estimated]), widths,
+                                         np.array([s.size for s in estimated]), self.dataset.size)
+        # Bounds on sign * score, which the candidate queue maximizes
+        sign = 1 if self.strategy == 'maximize' else -1
+        worst, best = np.minimum(sign * lower, sign * upper), np.maximum(sign * lower, sign * upper)
+        threshold = -np.inf if self.evaluation_threshold is None else sign * self.evaluation_threshold
+
+        cutoff = -np.inf
+        if self.candidates.full:
+            cutoff = sign * self.candidates.worst_score
+        if self.candidate_size is not None and self.algorithm == 'best_first':
+            # Subgroups certain to pass the threshold, a subgroup below the best candidate_size of them never stays
+            certain = [sign * s.score for s in subgroups if s.estimate is None and s.score is not None]
+            certain = [score for score in certain + list(worst) if score > threshold]
+            certain += [entry[0] for entry in self.candidates.heap]
+            if len(certain) >= self.candidate_size:
+                cutoff = max(cutoff, np.partition(certain, -self.candidate_size)[-self.candidate_size])
+
+        verified = []
+        for subgroup, bound in zip(estimated, best):
+            if not np.isnan(bound) and (bound <= threshold or bound < cutoff):
+                continue  # Keeps the estimate, admit drops it
+            parent = self.parents.get(id(subgroup))
+            if parent is not None and parent.stats is not None:
+                subgroup.stats = self.subset_stats(parent, subgroup.rows)
+            else:
+                subgroup.stats = self.backend.count(self.preferences, subgroup.rows)
+            subgroup.pm = subgroup.stats.aggregate(self.settings['aggregate_technique'])
+            subgroup.estimate = subgroup.score = None
+            verified.append(subgroup)
+        self.parents = dict()
+        self.depth_stats.verified += len(verified)
+        self.score(verified)
+
+    def add_refined(self, subgroup: Subgroup):
+        # Candidates refined by the worker pool arrive in serial order and still need the duplicate check
+        start = perf_counter()
+        constructed = self.constructed_descriptions.add(subgroup.description, self.current_depth)
+        self.depth_stats.dedupe += perf_counter() - start
+        if not constructed:
+            self.depth_stats.duplicates += 1
+        else:
+            subgroup.source = self.dataset.source
+            self.remember(subgroup)
+            self.admit(subgroup)
+
+    def cache_key(self, description: Description):
+        return self.evaluation_cache.key(self.fingerprint, description, self.settings['aggregate_technique'])
+
+    def remember(self, subgroup: Subgroup):
+        if self.evaluation_cache is not None and subgroup.estimate is None:
+            self.evaluation_cache.put(self.cache_key(subgroup.description), subgroup.size, subgroup.stats, subgroup.pm,
+                                      self.metric, subgroup.score)
+
+    def passes_threshold(self, score: float):
+        # Without a threshold every candidate is admitted and best_first keeps the `width` best of them,
+        # candidates were only admitted when a threshold was set, so a search given only a width found nothing
+        if self.evaluation_threshold is None:
+            return True
+        if self.strategy == 'maximize':
+            return score > self.evaluation_threshold
+        return score < self.evaluation_threshold
+
+    def admit(self, subgroup: Subgroup):
+        self.depth_stats.evaluated += 1
+        try:
+            if self.algorithm == 'apriori':
+                self.frequent_itemset.append(subgroup)
+            if subgroup.estimate is not None:
+                # Ruled out by the confidence interval of its estimated score
+                self.depth_stats.threshold_dropped += 1
+            elif self.passes_threshold(subgroup.score):
+                start = perf_counter()
+                self.add_subgroup(subgroup)
+                self.depth_stats.selection += perf_counter() - start
+            else:
+                self.depth_stats.threshold_dropped += 1
+        except:
+            self.depth_stats.errors += 1
+            logging.debug(f"Skipping subgroup with description: {str(subgroup.description)} due to comparison error")
+
     def add_subgroup(self, subgroup: Subgroup):
-        if self.algorithm == 'best_first':
-            if self.candidate_size is None or len(self.candidates) < self.candidate_size:
-                self.candidates.append(subgroup)
-                self.scores.append(subgroup.score)
-                self.worst_score = min(self.scores) if self.strategy == 'maximize' else max(self.scores)
-            elif (self.strategy == 'maximize' and subgroup.score > self.worst_score) or \
-                    (self.strategy == 'minimize' and subgroup.score < self.worst_score):
-                idx = self.scores.index(self.worst_score)
-                del self.scores[idx]
-                del self.candidates[idx]
-                self.candidates.append(subgroup)
-                self.scores.append(subgroup.score)
-                self.worst_score = min(self.scores) if self.strategy == 'maximize' else max(self.scores)
-        elif self.algorithm == 'apriori':
-            self.candidates.append(subgroup)
+        # Bounded by candidate_size for best_first, unbounded for apriori
+        if self.candidates.push(subgroup) and self.improvements is not None:
+            self.improvements.append(subgroup)
+
+    def refresh(self, subgroups: List[Subgroup], start: int):
+        """
+        Update the subgroups found before rows were appended to the dataset from position `start`.
+
+        The rows and statistics of every subgroup are extended with the new rows it covers, after which
+        the subgroups are scored again and the thresholds and width are applied as in the search. The
+        descriptions should be encoded.
+        """
+        refreshed = []
+        for subgroup in subgroups:
+            added = self.index.select(self.dataset.source, subgroup.description.description, start)
+            rows = subgroup.rows.extend(added)
+            coverage = rows.count / self.dataset.size
+            if self.frequency_threshold is not None and coverage < self.frequency_threshold:
+                self.depth_stats.frequency_dropped += 1
+                continue
+            stats = subgroup.stats + PreferenceStats.from_tensor(self.preferences[start + np.flatnonzero(added)])
+            pm = stats.aggregate(self.settings['aggregate_technique'])
+            refreshed.append(Subgroup(self.dataset.source, subgroup.description, pm=pm, coverage=coverage,
+                                      stats=stats, rows=rows))
+        self.score(refreshed)
+        for subgroup in refreshed:
+            self.remember(subgroup)
+            self.admit(subgroup)
+        self.select_candidates()
 
     def select_candidates(self):
-        self.candidates.sort(key=lambda x: x.score, reverse=(self.strategy == 'maximize'))
+        start = perf_counter()
         if self.width is not None:
-            self.candidates = self.candidates[:min(self.width, len(self.candidates))]
-        self.subgroups = deepcopy(self.candidates)
-        if len(self.subgroups) > 0:
-            self.scores = [s.score for s in self.subgroups]
-            self.worst_score = min(self.scores) if self.strategy == 'maximize' else max(self.scores)
-        else:
-            self.scores = []
-            self.worst_score = 0
+            self.candidates.truncate(self.width)
+        self.subgroups = self.candidates.best()
+        self.depth_stats.selection += perf_counter() - start
 
     def decrypt_descriptions(self, translation):
         for s in self.subgroups:
@@ -0,0 +1,129 @@
+import logging
+
+import numpy as np
+
+from epm.bitset import Bitset
+from epm.preference_matrix import PreferenceStats
+
+try:
+    import numba
+except ImportError:  # Optional, the NumPy backend is used instead
+    numba = None
+
+class NumpyBackend:
+    """
+    Kernels counting the -1/0/1 entries of the preference tensor over sets of rows.
+
+    The NumPy kernels select the rows into a temporary array and count every value
+    with a separate comparison.
+    """
+    name = 'numpy'
+
+    def count(self, preferences: np.ndarray, rows: Bitset):
+        """
+        Preference statistics of the rows of a bitset.
+        """
+        return PreferenceStats.from_tensor(preferences[rows.indices()])
+
+    def count_groups(self, preferences: np.ndarray, rows: np.ndarray, groups: np.ndarray, n_groups: int):
+        """
+        Number of -1, 0 and 1 entries per group of rows and cell, of shape (3, n_groups, L*(L-1)/2).
+
+        Parameters:
+            preferences (np.ndarray) - Packed preference tensor of the dataset
+            rows (np.ndarray) - Positions of the rows in the dataset
+            groups (np.ndarray) - Group of every row, in [0, n_groups)
+            n_groups (int) - Number of groups
+        """
+        order = np.argsort(groups, kind='stable')
+        sizes = np.bincount(groups, minlength=n_groups)
+        tensor = preferences[rows[order]]
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])[sizes > 0]
+        counts = np.zeros((3, n_groups, preferences.shape[1]), dtype=np.int64)
+        if len(tensor) > 0:
+            for i, value in enumerate((-1, 0, 1)):
+                counts[i][sizes > 0] = np.add.reduceat(tensor == value, starts, axis=0, dtype=np.int64)
+        return counts
+
+def _jit(function):
+    # Compiled with Numba when it is installed, otherwise the plain function, which only NumbaBackend uses
+    return function if numba is None else numba.njit(cache=True, nogil=True)(function)
+
+@_jit
+def _add_row(preferences, row, sums, offset):
+    # Per cell the number of present entries, their sum and their number of non-ties, NaN entries are skipped
+    for cell in range(preferences.shape[1]):
+        value = preferences[row, cell]
+        present = value == value
+        sums[0, offset + cell] += present
+        sums[1, offset + cell] += value if present else 0
+        sums[2, offset + cell] += abs(value) if present else 0
+
+@_jit
+def _counts(sums):
+    # -1, 0 and 1 counts from the number of entries (n), their sum (p - m) and non-ties (p + m)
+    positive = (sums[2] + sums[1]) / 2
+    negative = (sums[2] - sums[1]) / 2
+    tie = sums[0] - sums[2]
+    return negative.astype(np.int64), tie.astype(np.int64), positive.astype(np.int64)
+
+@_jit
+def _count_words(preferences, words, length):
+    # Walks the set bits of the packed bitset and counts the values of those rows in one pass
+    sums = np.zeros((3, preferences.shape[1]), dtype=np.float64)
+    for byte in range(len(words)):
+        word = words[byte]
+        if word == 0:
+            continue
+        for bit in range(8):
+            row = byte * 8 + bit
+            if word & (128 >> bit) and row < length:
+                _add_row(preferences, row, sums, 0)
+    return _counts(sums)
+
+@_jit
+def _count_groups(preferences, rows, groups, n_groups):
+    cells = preferences.shape[1]
+    sums = np.zeros((3, n_groups * cells), dtype=np.float64)
+    for i in range(len(rows)):
+        _add_row(preferences, rows[i], sums, groups[i] * cells)
+    negative, tie, positive = _counts(sums)
+    counts = np.empty((3, n_groups, cells), dtype=np.int64)
+    counts[0] = negative.reshape(n_groups, cells)
+    counts[1] = tie.reshape(n_groups, cells)
+    counts[2] = positive.reshape(n_groups, cells)
+    return counts
+
+class NumbaBackend(NumpyBackend):
+    """
+    Kernels compiled with Numba, which count the rows straight from the bitset or row
+    positions in a single pass without temporary arrays. Compiled on first use and
+    cached on disk.
+    """
+    name = 'numba'
+
+    def count(self, preferences: np.ndarray, rows: Bitset):
+        negative, tie, positive = _count_words(np.asarray(preferences), rows.words, rows.length)
+        return PreferenceStats(negative, tie, positive, rows.count)
+
+    def count_groups(self, preferences: np.ndarray, rows: np.ndarray, groups: np.ndarray, n_groups: int):
+        return _count_groups(np.asarray(preferences), rows, groups, n_groups)
+
+backends = dict(
+    numpy=NumpyBackend,
+    numba=NumbaBackend
+)
+
+def get_backend(name: str = 'numpy'):
+    """
+    Backend by name: 'numpy', 'numba', or 'auto' for Numba when it is installed. Without Numba,
+    'numba' falls back to NumPy with a warning.
+    """
+    if name == 'auto':
+        name = 'numpy' if numba is None else 'numba'
+    if name not in backends:
+        raise ValueError(f"Invalid backend: {name}")
+    if name == 'numba' and numba is None:
+        logging.warning("Numba is not installed, falling back to the NumPy backend")
+        name = 'numpy'
+    return backends[name]()
@@ -0,0 +1,76 @@
+import numpy as np
+
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount(words: np.ndarray):
+    if hasattr(np, 'bitwise_count'):  # NumPy >= 2.0
+        return int(np.bitwise_count(words).sum())
+    return int(_POPCOUNT[words].sum())
+
+class Bitset:
+    """
+    Compact set of row positions of the dataset, stored as packed bits.
+
+    Intersections are a bitwise AND over n/8 bytes and the number of rows
+    is a popcount, which is cached since bitsets are never modified in place.
+    """
+    __slots__ = ('words', 'length', '_count')
+
+    def __init__(self, words: np.ndarray, length: int, count: int = None):
+        self.words = words
+        self.length = length
+        self._count = count
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray):
+        return cls(np.packbits(mask), len(mask))
+
+    @classmethod
+    def from_indices(cls, indices: np.ndarray, length: int):
+        mask = np.zeros(length, dtype=bool)
+        mask[indices] = True
+        return cls(np.packbits(mask), length, len(indices))
+
+    @classmethod
+    def full(cls, length: int):
+        return cls(np.packbits(np.ones(length, dtype=bool)), length, length)
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = popcount(self.words)
+        return self._count
+
+    def to_mask(self):
+        return np.unpackbits(self.words, count=self.length).view(bool)
+
+    def first(self):
+        # Position of the first row in the set (length when empty)
+        nonzero = np.flatnonzero(self.words)
+        if len(nonzero) == 0:
+            return self.length
+        byte = nonzero[0]
+        return int(byte) * 8 + 8 - int(self.words[byte]).bit_length()
+
+    def indices(self):
+        return np.flatnonzero(self.to_mask())
+
+    def extend(self, mask: np.ndarray):
+        # New bitset with the rows of `mask` appended after the last row
+        return Bitset(np.packbits(np.concatenate([self.to_mask(), mask])), self.length + len(mask),
+                      self.count + int(np.count_nonzero(mask)))
+
+    def __and__(self, other: 'Bitset'):
+        return Bitset(self.words & other.words, self.length)
+
+    def __or__(self, other: 'Bitset'):
+        return Bitset(self.words | other.words, self.length)
+
+    def __sub__(self, other: 'Bitset'):
+        return Bitset(self.words & ~other.words, self.length)
+
+    def __eq__(self, other):
+        return isinstance(other, Bitset) and self.length == other.length and np.array_equal(self.words, other.words)
+
+    def __hash__(self):
+        return hash((self.length, self.words.tobytes()))
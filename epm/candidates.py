@@ -0,0 +1,75 @@
+import heapq
+import math
+
+from itertools import count
+from typing import List
+
+from epm.subgroup import Subgroup
+
+class CandidateQueue:
+    """
+    Bounded priority queue of the best scoring subgroups.
+
+    The heap keeps the worst candidate on top, so inserting and evicting are
+    O(log k). Candidates with equal scores are ranked in insertion order, and
+    on eviction the earliest inserted of the worst candidates is dropped first.
+    """
+
+    def __init__(self, strategy: str, capacity: int = None):
+        if strategy not in ('maximize', 'minimize'):
+            raise ValueError(f"Invalid strategy: `{strategy}`")
+        self.sign = 1 if strategy == 'maximize' else -1
+        self.capacity = capacity
+        self.heap = []  # Entries (sign * score, insertion number, subgroup)
+        self.counter = count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __iter__(self):
+        return iter(self.best())
+
+    @property
+    def full(self):
+        return self.capacity is not None and len(self.heap) >= self.capacity
+
+    @property
+    def worst_score(self):
+        return self.sign * self.heap[0][0] if self.heap else None
+
+    def push(self, subgroup: Subgroup):
+        """
+        Add a subgroup, evicting the worst candidate when the queue is full.
+
+        Returns:
+            added (bool) - Whether the subgroup was kept
+        """
+        if subgroup.score is None or math.isnan(subgroup.score):
+            return False
+        entry = (self.sign * subgroup.score, next(self.counter), subgroup)
+        if not self.full:
+            heapq.heappush(self.heap, entry)
+            return True
+        if self.heap and entry[0] > self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+            return True
+        return False
+
+    def best(self, n: int = None) -> List[Subgroup]:
+        """
+        The n best candidates (all when n is None), best first.
+        """
+        key = lambda entry: (-entry[0], entry[1])
+        if n is None or n >= len(self.heap):
+            entries = sorted(self.heap, key=key)
+        else:
+            entries = heapq.nsmallest(n, self.heap, key=key)
+        return [entry[2] for entry in entries]
+
+    def truncate(self, n: int):
+        """
+        Keep only the n best candidates.
+        """
+        if n < len(self.heap):
+            self.heap = heapq.nsmallest(n, self.heap, key=lambda entry: (-entry[0], entry[1]))
+            heapq.heapify(self.heap)
@@ -0,0 +1,292 @@
+import hashlib
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+
+from typing import Callable, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from epm.util import downsize
+from epm.preference_matrix import PreferenceStats, preference_tensor, ranking_labels
+
+CACHE_VERSION = 1  # Part of the cache key, increase when the encoding changes
+
+def content_key(data, labels: List[str] = None):
+    """
+    Hash of a DataFrame or the contents of a CSV file, used as key of the dataset cache.
+    """
+    digest = hashlib.sha256(f'epm-{CACHE_VERSION}-{labels}'.encode())
+    if isinstance(data, pd.DataFrame):
+        digest.update(str([(str(column), str(dtype)) for column, dtype in data.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    else:
+        with open(data, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def load_cached(cache_dir: str, key: str, build: Callable[[], 'Dataset']):
+    """
+    Map the dataset stored under `key` in the cache directory, or build and store it when missing.
+    """
+    directory = os.path.join(cache_dir, key)
+    if os.path.isfile(os.path.join(directory, 'meta.pkl')):
+        logging.info(f"Loading cached dataset {key}")
+        return Dataset.load(directory)
+    dataset = build()
+    os.makedirs(cache_dir, exist_ok=True)
+    # Written next to its final place and renamed, so a half written entry is never mapped
+    staging = tempfile.mkdtemp(prefix=f'.{key}-', dir=cache_dir)
+    try:
+        dataset.save(staging)
+        os.replace(staging, directory)
+    except OSError:
+        # Another process stored the same dataset in the meantime
+        shutil.rmtree(staging, ignore_errors=True)
+        if not os.path.isfile(os.path.join(directory, 'meta.pkl')):
+            raise
+    logging.info(f"Cached dataset {key}")
+    return Dataset.load(directory)
+
+def encode_categorical(values: pd.Series, categories: dict):
+    # Known values keep their code, new values get the next code, missing values get code -1
+    codes, uniques = pd.factorize(values)
+    mapping = np.array([categories.setdefault(value, len(categories)) for value in uniques] + [-1], dtype=np.int64)
+    return mapping[codes]
+
+def promote_to_float(files: dict, dtypes: dict, column: str):
+    # Rewrite the values of a column written so far as float32
+    name = files[column].name
+    files[column].close()
+    values = np.fromfile(name, dtype=dtypes[column]).astype(np.float32)
+    dtypes[column] = np.dtype(np.float32)
+    files[column] = open(name, 'wb')
+    files[column].write(values.tobytes())
+
+class Dataset:
+    """
+    Encoded ranking dataset the search runs against.
+
+    Holds every descriptive column as a NumPy array (categorical columns as codes, decoded
+    through `translations`) and the packed preference tensor with one row per ranking.
+    The arrays may be memory-mapped files, in which case `frame` is None and rows are only
+    materialized as a DataFrame on request.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], preferences: np.ndarray, labels: List[str],
+                 translations: Dict[str, pd.Index], frame: pd.DataFrame = None, stats: PreferenceStats = None,
+                 directory=None, files: Dict[str, str] = None):
+        self.columns = columns
+        self.preferences = preferences
+        self.labels = labels
+        self.translations = translations
+        self.frame = frame
+        self._stats = stats
+        self._fingerprint = None
+        self.directory = directory  # Keeps a temporary directory with the arrays alive
+        self.files = files  # Raw array files written by `from_chunks`, which `append` extends
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame, labels: List[str] = None):
+        df, translations = downsize(data.reset_index(drop=True))
+
+        # Generate the packed preference tensor, row i of the tensor belongs to row i of the dataset
+        preferences, labels = preference_tensor(df['ranking'], labels)
+
+        columns = {column: df[column].to_numpy() for column in df.columns if column != 'ranking'}
+        return cls(columns, preferences, labels, translations, frame=df)
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[pd.DataFrame], directory: str = None, labels: List[str] = None):
+        """
+        Encode a dataset chunk by chunk into arrays on disk, which are memory-mapped afterwards.
+
+        Categorical (object) columns are factorized consistently over all chunks, numerical columns keep
+        the dtype of the first chunk (floats as float32), an integer column becomes float32 when a later
+        chunk has missing or fractional values in it. Unless given, the labels are inferred from the
+        first chunk; a later chunk with another label raises a ValueError.
+
+        Parameters:
+            chunks (Iterable[pd.DataFrame]) - Chunks of the dataset, each with a `ranking` column
+            directory (str) - Directory for the arrays, a temporary directory when not given
+            labels (List[str]) - List of labels
+
+        Returns:
+            dataset (Dataset) - Memory-mapped dataset
+        """
+        temporary = None
+        if directory is None:
+            temporary = tempfile.TemporaryDirectory(prefix='epm-')
+            directory = temporary.name
+        os.makedirs(directory, exist_ok=True)
+
+        files, dtypes, categories = dict(), dict(), dict()
+        stats, size = None, 0
+        try:
+            for chunk in chunks:
+                if labels is None:
+                    labels = ranking_labels(chunk['ranking'].dropna().unique())
+                tensor, _ = preference_tensor(chunk['ranking'], labels)
+                chunk_stats = PreferenceStats.from_tensor(tensor)
+                stats = chunk_stats if stats is None else stats + chunk_stats
+                if 'ranking' not in files:
+                    files['ranking'] = open(os.path.join(directory, 'preferences.bin'), 'wb')
+                files['ranking'].write(tensor.tobytes())
+
+                for column in chunk.columns:
+                    if column == 'ranking':
+                        continue
+                    values = chunk[column]
+                    if column not in dtypes:
+                        if values.dtype.kind == 'f':
+                            dtypes[column] = np.dtype(np.float32)
+                        elif values.dtype.kind in 'iub':
+                            dtypes[column] = values.dtype
+                        else:  # Object, string or category
+                            dtypes[column] = np.dtype(np.int64)
+                            categories[column] = dict()
+                        files[column] = open(os.path.join(directory, f'column_{len(dtypes)}.bin'), 'wb')
+                    if column in categories:
+                        encoded = encode_categorical(values, categories[column])
+                    else:
+                        if dtypes[column].kind in 'iub' and (values.dtype.kind not in 'iub' or values.isna().any()):
+                            # Missing or fractional values after integer chunks, the column becomes float
+                            promote_to_float(files, dtypes, column)
+                        encoded = values.to_numpy(dtype=dtypes[column])
+                    files[column].write(encoded.tobytes())
+                size += len(chunk)
+                logging.info(f"Encoded {size} rows")
+        finally:
+            for file in files.values():
+                file.close()
+
+        if size == 0:
+            raise ValueError("No rows to load")
+
+        preferences = np.memmap(files.pop('ranking').name, dtype=np.float32, mode='r',
+                                shape=(size, len(stats.negative)))
+        columns = {column: np.memmap(file.name, dtype=dtypes[column], mode='r', shape=(size,))
+                   for column, file in files.items()}
+        translations = {column: pd.Index(list(values)) for column, values in categories.items()}
+        files = {column: file.name for column, file in files.items()}
+        files['ranking'] = preferences.filename
+        return cls(columns, preferences, labels, translations, stats=stats, directory=temporary or directory,
+                   files=files)
+
+    def append(self, data: pd.DataFrame):
+        """
+        Encode new rows and add them to the end of the dataset.
+
+        Categorical columns keep their codes and new values get new codes, the rankings should only use the
+        labels of the dataset. The arrays of a dataset streamed by `from_chunks` grow on disk, other arrays
+        are concatenated in memory.
+
+        Returns:
+            stats (PreferenceStats) - Preference statistics of the new rows
+        """
+        data = data.reset_index(drop=True)
+        if set(data.columns) != set(self.columns) | {'ranking'}:
+            raise ValueError("The new rows should have the columns of the dataset")
+        tensor, _ = preference_tensor(data['ranking'], self.labels)
+        stats = PreferenceStats.from_tensor(tensor)
+        total = self.stats + stats
+
+        encoded = dict()
+        for column, values in self.columns.items():
+            if column in self.translations:
+                categories = {value: code for code, value in enumerate(self.translations[column])}
+                encoded[column] = encode_categorical(data[column], categories)
+                self.translations[column] = pd.Index(list(categories))
+            elif self.files is not None:
+                if values.dtype.kind in 'iub' and (data[column].dtype.kind not in 'iub' or data[column].isna().any()):
+                    raise ValueError(f"Column {column} is stored as integers on disk, the new rows should have integer values")
+                encoded[column] = data[column].to_numpy(dtype=values.dtype)
+            else:
+                encoded[column] = data[column].to_numpy()
+
+        size = len(self) + len(data)
+        if self.files is not None:
+            for column, array in list(encoded.items()) + [('ranking', tensor)]:
+                with open(self.files[column], 'ab') as file:
+                    file.write(array.tobytes())
+            self.preferences = np.memmap(self.files['ranking'], dtype=np.float32, mode='r',
+                                         shape=(size, tensor.shape[1]))
+            self.columns = {column: np.memmap(self.files[column], dtype=values.dtype, mode='r', shape=(size,))
+                            for column, values in self.columns.items()}
+        else:
+            self.preferences = np.concatenate([self.preferences, tensor])
+            self.columns = {column: np.concatenate([values, encoded[column]]) for column, values in self.columns.items()}
+        if self.frame is not None:
+            new_frame = pd.DataFrame(encoded).assign(ranking=data['ranking'])[self.frame.columns]
+            self.frame = pd.concat([self.frame, new_frame], ignore_index=True)
+        self._stats = total
+        self._fingerprint = None
+        return stats
+
+    def save(self, directory: str):
+        """
+        Store the encoded dataset as `.npy` files, which `load` maps back into memory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'preferences.npy'), self.preferences)
+        for position, values in enumerate(self.columns.values()):
+            np.save(os.path.join(directory, f'column_{position}.npy'), values)
+        stats = self.stats
+        np.save(os.path.join(directory, 'stats.npy'), np.stack([stats.negative, stats.tie, stats.positive]))
+        # The metadata is written last, it marks the entry as complete
+        with open(os.path.join(directory, 'meta.pkl'), 'wb') as file:
+            pickle.dump(dict(columns=list(self.columns), labels=self.labels, translations=self.translations,
+                             size=stats.size), file)
+
+    @classmethod
+    def load(cls, directory: str):
+        with open(os.path.join(directory, 'meta.pkl'), 'rb') as file:
+            meta = pickle.load(file)
+        preferences = np.load(os.path.join(directory, 'preferences.npy'), mmap_mode='r')
+        columns = {column: np.load(os.path.join(directory, f'column_{position}.npy'), mmap_mode='r')
+                   for position, column in enumerate(meta['columns'])}
+        negative, tie, positive = np.load(os.path.join(directory, 'stats.npy'))
+        stats = PreferenceStats(negative, tie, positive, meta['size'])
+        return cls(columns, preferences, meta['labels'], meta['translations'], stats=stats, directory=directory)
+
+    def __len__(self):
+        return len(self.preferences)
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+    @property
+    def stats(self):
+        if self._stats is None:
+            self._stats = PreferenceStats.from_tensor(self.preferences)
+        return self._stats
+
+    @property
+    def fingerprint(self):
+        # Hash of the encoded dataset, identifies it in the evaluation cache
+        if self._fingerprint is None:
+            digest = hashlib.sha256(f'{self.labels}-{self.column_names}'.encode())
+            for array in [self.preferences, *self.columns.values()]:
+                digest.update(array.dtype.str.encode())
+                for start in range(0, len(array), 1 << 20):
+                    digest.update(np.ascontiguousarray(array[start:start + (1 << 20)]).tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def __getitem__(self, column: str):
+        return self.columns[column]
+
+    def to_frame(self):
+        if self.frame is not None:
+            return self.frame
+        return pd.DataFrame({column: np.asarray(values) for column, values in self.columns.items()})
+
+    def take(self, indices: np.ndarray):
+        if self.frame is not None:
+            return self.frame.iloc[indices]
+        return pd.DataFrame({column: values[indices] for column, values in self.columns.items()}, index=indices)
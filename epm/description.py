@@ -1,45 +1,95 @@
 from typing import Union
-from itertools import chain
-from copy import deepcopy
+from collections import Counter
 
 
 class Description:
+    """
+    Immutable conjunction of selectors `attribute = value` (or an interval `(lower, upper)`).
 
-    def __init__(self, attribute: str, value: Union[str, float, int, bool] = None, dictionary: dict = None):
+    A description is a node holding its last selector and the description it refines, so a
+    refinement shares all other selectors with its parent instead of copying them. Every
+    operation returns a new description.
+    """
+    __slots__ = ('parent', 'attribute', 'value', '_key')
+
+    def __init__(self, attribute: str, value: Union[str, float, int, bool, tuple] = None, dictionary: dict = None,
+                 parent: 'Description' = None):
         if dictionary is not None:
-            self.description = deepcopy(dictionary)
-        else:
-            if attribute == 'all':
-                value = 'all'
-            self.description = dict()
-            self.description[attribute] = value
+            *items, (attribute, value) = dictionary.items()
+            for item in items:
+                parent = Description(*item, parent=parent)
+        elif attribute == 'all':
+            value = 'all'
+        self.parent = parent
+        self.attribute = attribute
+        self.value = tuple(value) if isinstance(value, list) else value
+        self._key = None
+
+    def items(self):
+        # Selectors from the first to the last one added
+        node, items = self, []
+        while node is not None:
+            items.append((node.attribute, node.value))
+            node = node.parent
+        return reversed(items)
+
+    @property
+    def description(self):
+        return dict(self.items())
 
     def __contains__(self, col):
-        return col in self.description
+        node = self
+        while node is not None:
+            if node.attribute == col:
+                return True
+            node = node.parent
+        return False
+
+    def __len__(self):
+        return 0 if self.attribute == 'all' else 1 + (0 if self.parent is None else len(self.parent))
+
+    @property
+    def key(self):
+        # Canonical hashable form: (attribute, selector) pairs sorted on attribute
+        if self._key is None:
+            self._key = tuple(sorted(self.items()))
+        return self._key
 
     def extend(self, attribute, value):
-        if 'all' in self.description:
-            self.description = dict()
-            self.description[attribute] = value
-        else:
-            self.description[attribute] = value
-        return self
-    
+        if self.attribute == 'all':
+            return Description(attribute, value)
+        return Description(attribute, value, parent=self)
+
     def merge(self, other: 'Description'):
-        self.description.update(other.description)
+        # Selectors of other are added, for an attribute in both descriptions the value of other is kept
+        description = self.description
+        if any(attribute in description and description[attribute] != value for attribute, value in other.items()):
+            description.update(other.items())
+            return Description(None, dictionary=description)
+        merged = self
+        for attribute, value in other.items():
+            if attribute not in description:
+                merged = merged.extend(attribute, value)
+        return merged
+
+    def translated(self, translate):
+        # Description with every selector value passed through translate(attribute, value)
+        return Description(None, dictionary={attribute: translate(attribute, value) for attribute, value in self.items()})
 
     def decrypt(self, translation):
-        for key, value in self.description.items():
-            if key in translation:
-                self.description[key] = translation[key][value]
+        return self.translated(lambda key, value: translation[key][value] if key in translation else value)
+
+    def encrypt(self, translation):
+        # Inverse of decrypt, back to the codes of the categorical values
+        return self.translated(lambda key, value: translation[key].get_loc(value) if key in translation else value)
 
     def __str__(self):
-        if 'all' in self.description:
+        if self.attribute == 'all':
             return 'all'
         else:
             result = []
-            for key, value in self.description.items():
-                if isinstance(value, list):
+            for key, value in self.items():
+                if isinstance(value, tuple):
                     if value[1] is None:
                         result.append(f"{key} >= {round(value[0], 3)}")
                     elif value[0] is None:
@@ -49,3 +99,30 @@ class Description:
                 else:
                     result.append(f"{key} = {value}")
             return " && ".join(result)
+
+
+class DescriptionRegistry:
+    """
+    Set of the descriptions constructed during a search, keyed on `Description.key`.
+
+    Besides O(1) membership it counts, per depth step, how often an already
+    constructed description was generated again.
+    """
+
+    def __init__(self):
+        self.keys = set()
+        self.hits = Counter()
+
+    def add(self, description: Description, depth: int = None):
+        key = description.key
+        if key in self.keys:
+            self.hits[depth] += 1
+            return False
+        self.keys.add(key)
+        return True
+
+    def __contains__(self, description: Description):
+        return description.key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
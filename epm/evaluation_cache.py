@@ -0,0 +1,121 @@
+import logging
+import os
+import pickle
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict
+
+from epm.description import Description
+from epm.preference_matrix import PM, PreferenceStats
+
+ENTRY_OVERHEAD = 512  # Rough size in bytes of the key, the entry object and the dictionaries
+
+@dataclass
+class CacheEntry:
+    size: int
+    stats: PreferenceStats
+    pm: PM
+    scores: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def nbytes(self):
+        return (self.stats.negative.nbytes + self.stats.tie.nbytes + self.stats.positive.nbytes + self.pm.pm.nbytes
+                + ENTRY_OVERHEAD)
+
+class EvaluationCache:
+    """
+    Evaluated subgroups keyed by (dataset fingerprint, canonical description, aggregate technique).
+
+    Holds the size, the preference statistics, the aggregated matrix and the score per metric,
+    so searches over the same dataset with another algorithm or metric skip re-evaluating the
+    descriptions they have in common. Entries are evicted least recently used first once the
+    cache grows over `max_bytes`. With a `path`, the cache is read from that file when it exists
+    and `save` writes it back.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2, path: str = None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.isfile(path):
+            with open(path, 'rb') as file:
+                for key, entry in pickle.load(file):
+                    self.store(key, entry)
+            logging.info(f"Loaded {len(self.entries)} cached evaluations from {path}")
+
+    @staticmethod
+    def key(fingerprint: str, description: Description, aggregate_technique: str):
+        return fingerprint, description.key, aggregate_technique
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key) -> CacheEntry:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, size: int, stats: PreferenceStats, pm: PM, metric: str = None, score: float = None):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = CacheEntry(size, stats, pm)
+            self.store(key, entry)
+        else:
+            self.entries.move_to_end(key)
+        if metric is not None and score is not None:
+            entry.scores[metric] = score
+
+    def store(self, key, entry: CacheEntry):
+        self.entries[key] = entry
+        self.nbytes += entry.nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 0:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def rebase(self, fingerprint: str, new_fingerprint: str, update: Callable[[tuple, PreferenceStats], PreferenceStats]):
+        """
+        Move the entries of a dataset to the fingerprint of a grown version of it.
+
+        `update` is called with the description key and the statistics of an entry and returns the
+        statistics on the grown dataset. The scores are dropped, since they depend on the preference
+        matrix of the whole dataset.
+        """
+        for key in [key for key in self.entries if key[0] == fingerprint]:
+            entry = self.entries.pop(key, None)
+            if entry is None:  # Evicted while storing the moved entries
+                continue
+            self.nbytes -= entry.nbytes
+            stats = update(key[1], entry.stats)
+            self.store((new_fingerprint,) + key[1:], CacheEntry(stats.size, stats, stats.aggregate(key[2])))
+
+    def subset(self, fingerprint: str, aggregate_technique: str):
+        """
+        Copy holding only the entries of a dataset and aggregate technique, without a size limit, which
+        the worker processes of a search read from.
+        """
+        subset = EvaluationCache(max_bytes=float('inf'))
+        for key, entry in self.entries.items():
+            if key[0] == fingerprint and key[2] == aggregate_technique:
+                subset.store(key, entry)
+        return subset
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def save(self, path: str = None):
+        path = self.path if path is None else path
+        if path is None:
+            raise ValueError("No path to save the evaluation cache to")
+        # Least recently used first, so loading keeps the eviction order
+        with open(path + '.tmp', 'wb') as file:
+            pickle.dump(list(self.entries.items()), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
@@ -1,6 +1,5 @@
 import numpy as np
 
-from epm.preference_matrix import distance_matrix
 from epm.subgroup import Subgroup
 
 def rw_norm(dataset: Subgroup, item: Subgroup):
@@ -16,11 +15,7 @@ def rw_norm(dataset: Subgroup, item: Subgroup):
     Returns:
         rw_norm (float) - Rankingwise Norm
     """
-    normalization, matrix_d, matrix_s = split(dataset, item)
-
-    matrix_l = distance_matrix(matrix_d, matrix_s)
-    
-    return normalization * np.linalg.norm(matrix_l, ord='fro')
+    return single(rw_norm_batch, dataset, item)
 
 def rw_cov(dataset: Subgroup, item: Subgroup):
     """
@@ -35,12 +30,7 @@ def rw_cov(dataset: Subgroup, item: Subgroup):
     Returns:
         rw_cov (float) - Rankingwise Covariance
     """
-    normalization, matrix_d, matrix_s = split(dataset, item)
-
-    vector_d = matrix_d.pm.flatten()
-    vector_s = matrix_s.pm.flatten()
-
-    return -normalization * np.cov(vector_d, vector_s)[0, 1]
+    return single(rw_cov_batch, dataset, item)
 
 def lw_norm(dataset: Subgroup, item: Subgroup):
     """
@@ -55,19 +45,7 @@ def lw_norm(dataset: Subgroup, item: Subgroup):
     Returns:
         lw_norm (float) - Labelwise Norm
     """
-    normalization, matrix_d, matrix_s = split(dataset, item)
-
-    matrix_l = distance_matrix(matrix_d, matrix_s)
-
-    max_val = 0
-
-    for i in range(matrix_l.shape[0]):
-        sum_i_j = 0
-        for j in range(matrix_l.shape[1]):
-            sum_i_j += matrix_l[i, j]**2
-        max_val = max(max_val, sum_i_j)
-
-    return normalization * max_val
+    return single(lw_norm_batch, dataset, item)
 
 def pw_max(dataset: Subgroup, item: Subgroup):
     """
@@ -82,22 +60,229 @@ def pw_max(dataset: Subgroup, item: Subgroup):
     Returns:
         pw_max (float) - Pairwise Max
     """
-    normalization, matrix_d, matrix_s = split(dataset, item)
+    return single(pw_max_batch, dataset, item)
+
+def rw_norm_batch(matrix_d: np.ndarray, matrices_s: np.ndarray, sizes_s: np.ndarray, size_n: int):
+    """
+    Compute the Rankingwise Norm quality measure for k subgroups at once.
+
+    Parameters:
+        matrix_d (np.ndarray) - Dataset preference matrix of shape (L, L)
+        matrices_s (np.ndarray) - Subgroup preference matrices of shape (k, L, L)
+        sizes_s (np.ndarray) - Sizes of the k subgroups
+        size_n (int) - Size of dataset
+
+    Returns:
+        rw_norm (np.ndarray) - Rankingwise Norm of every subgroup
+    """
+    matrices_l = batch_distance_matrices(matrix_d, matrices_s)
+
+    return normalization(sizes_s, size_n) * np.linalg.norm(matrices_l, ord='fro', axis=(1, 2))
+
+def rw_cov_batch(matrix_d: np.ndarray, matrices_s: np.ndarray, sizes_s: np.ndarray, size_n: int):
+    """
+    Compute the Rankingwise Covariance quality measure for k subgroups at once.
+
+    Parameters:
+        matrix_d (np.ndarray) - Dataset preference matrix of shape (L, L)
+        matrices_s (np.ndarray) - Subgroup preference matrices of shape (k, L, L)
+        sizes_s (np.ndarray) - Sizes of the k subgroups
+        size_n (int) - Size of dataset
+
+    Returns:
+        rw_cov (np.ndarray) - Rankingwise Covariance of every subgroup
+    """
+    vector_d = matrix_d.flatten()
+    vectors_s = matrices_s.reshape(len(matrices_s), -1)
+
+    # Sample covariance, as np.cov computes it
+    covariance = ((vectors_s - vectors_s.mean(axis=1, keepdims=True)) @ (vector_d - vector_d.mean())) / (len(vector_d) - 1)
+
+    return -normalization(sizes_s, size_n) * covariance
+
+def lw_norm_batch(matrix_d: np.ndarray, matrices_s: np.ndarray, sizes_s: np.ndarray, size_n: int):
+    """
+    Compute the Labelwise Norm quality measure for k subgroups at once.
+
+    Parameters:
+        matrix_d (np.ndarray) - Dataset preference matrix of shape (L, L)
+        matrices_s (np.ndarray) - Subgroup preference matrices of shape (k, L, L)
+        sizes_s (np.ndarray) - Sizes of the k subgroups
+        size_n (int) - Size of dataset
+
+    Returns:
+        lw_norm (np.ndarray) - Labelwise Norm of every subgroup
+    """
+    matrices_l = batch_distance_matrices(matrix_d, matrices_s)
 
-    matrix_l = distance_matrix(matrix_d, matrix_s)
+    # Labels with an undefined (NaN) row sum do not count towards the maximum
+    row_sums = np.nan_to_num(np.sum(matrices_l ** 2, axis=2), nan=0)
 
-    max_val = 0
+    return normalization(sizes_s, size_n) * np.max(row_sums, axis=1, initial=0)
 
-    for i in range(matrix_l.shape[0]):
-        for j in range(matrix_l.shape[1]):
-            max_val = max(max_val, abs(matrix_l[i, j]))
+def pw_max_batch(matrix_d: np.ndarray, matrices_s: np.ndarray, sizes_s: np.ndarray, size_n: int):
+    """
+    Compute the Pairwise Max quality measure for k subgroups at once.
 
-    return normalization * max_val
+    Parameters:
+        matrix_d (np.ndarray) - Dataset preference matrix of shape (L, L)
+        matrices_s (np.ndarray) - Subgroup preference matrices of shape (k, L, L)
+        sizes_s (np.ndarray) - Sizes of the k subgroups
+        size_n (int) - Size of dataset
+
+    Returns:
+        pw_max (np.ndarray) - Pairwise Max of every subgroup
+    """
+    matrices_l = batch_distance_matrices(matrix_d, matrices_s)
+
+    # Undefined (NaN) pairs do not count towards the maximum
+    pairs = np.nan_to_num(np.abs(matrices_l), nan=0)
+
+    return normalization(sizes_s, size_n) * np.max(pairs, axis=(1, 2), initial=0)
+
+def rw_norm_estimate(dataset: Subgroup, item: Subgroup):
+    """
+    Optimistic estimate of the Rankingwise Norm: an upper bound on the score of any refinement of a subgroup.
+
+    Parameters:
+        dataset (Subgroup) - Dataset
+        item (Subgroup) - Subgroup to be refined
+
+    Returns:
+        estimate (float) - Upper bound on rw_norm
+    """
+    return normalization(item.size, dataset.size) * np.sqrt(np.nansum(maximal_distance_matrix(dataset, item) ** 2))
+
+def rw_cov_estimate(dataset: Subgroup, item: Subgroup):
+    """
+    Optimistic estimate of the Rankingwise Covariance: a lower bound on the score of any refinement of a subgroup.
+
+    Parameters:
+        dataset (Subgroup) - Dataset
+        item (Subgroup) - Subgroup to be refined
+
+    Returns:
+        estimate (float) - Lower bound on rw_cov
+    """
+    vector_d = dataset.pm.pm.flatten()
+    centred_d = vector_d - np.nanmean(vector_d)
+    lowest, highest = refinement_ranges(dataset, item)
+
+    # The covariance is largest when every subgroup entry sits at the end of its range
+    # that matches the sign of the centred dataset entry
+    covariance = np.nansum(np.maximum(centred_d * lowest.flatten(), centred_d * highest.flatten())) / (len(vector_d) - 1)
+
+    # A negative covariance gives a positive score, which is closer to 0 for a smaller refinement
+    return -normalization(item.size, dataset.size) * max(covariance, 0)
+
+def lw_norm_estimate(dataset: Subgroup, item: Subgroup):
+    """
+    Optimistic estimate of the Labelwise Norm: an upper bound on the score of any refinement of a subgroup.
+
+    Parameters:
+        dataset (Subgroup) - Dataset
+        item (Subgroup) - Subgroup to be refined
+
+    Returns:
+        estimate (float) - Upper bound on lw_norm
+    """
+    row_sums = np.nansum(maximal_distance_matrix(dataset, item) ** 2, axis=1)
+
+    return normalization(item.size, dataset.size) * np.max(row_sums, initial=0)
+
+def pw_max_estimate(dataset: Subgroup, item: Subgroup):
+    """
+    Optimistic estimate of the Pairwise Max: an upper bound on the score of any refinement of a subgroup.
+
+    Parameters:
+        dataset (Subgroup) - Dataset
+        item (Subgroup) - Subgroup to be refined
+
+    Returns:
+        estimate (float) - Upper bound on pw_max
+    """
+    return normalization(item.size, dataset.size) * np.nanmax(maximal_distance_matrix(dataset, item), initial=0)
+
+def distance_bounds(matrix_d: np.ndarray, matrices_s: np.ndarray, half_widths: np.ndarray):
+    # Smallest and largest absolute distance per pair when every subgroup entry lies within its half width
+    distances = np.abs(batch_distance_matrices(matrix_d, matrices_s))
+    # Any subgroup entry in [-1, 1] is possible for a pair without sampled entries
+    farthest = .5 * (1 + np.abs(matrix_d))
+    unknown = np.isnan(distances) | np.isinf(half_widths)
+    lowest = np.where(unknown, 0, np.maximum(distances - .5 * half_widths, 0))
+    highest = np.where(unknown, farthest, np.minimum(distances + .5 * half_widths, farthest))
+    return lowest, highest
+
+def monotone_bounds(batch_function):
+    """
+    Bounds on a quality measure that only grows with the absolute distance of every pair, for subgroup
+    matrices known up to a half width per entry.
+    """
+    def bounds(matrix_d: np.ndarray, matrices_s: np.ndarray, half_widths: np.ndarray, sizes_s: np.ndarray, size_n: int):
+        lowest, highest = distance_bounds(matrix_d, matrices_s, half_widths)
+        # Subgroup matrices at exactly these distances from the dataset matrix
+        return (batch_function(matrix_d, matrix_d[np.newaxis] - 2 * lowest, sizes_s, size_n),
+                batch_function(matrix_d, matrix_d[np.newaxis] - 2 * highest, sizes_s, size_n))
+    return bounds
+
+def rw_cov_bounds(matrix_d: np.ndarray, matrices_s: np.ndarray, half_widths: np.ndarray, sizes_s: np.ndarray, size_n: int):
+    """
+    Bounds on the Rankingwise Covariance for subgroup matrices known up to a half width per entry.
+    The covariance is linear in the subgroup entries, so it moves at most the half widths weighted
+    by the centred dataset entries.
+    """
+    vector_d = matrix_d.flatten()
+    widths = half_widths.reshape(len(half_widths), -1) @ np.abs(vector_d - vector_d.mean()) / (len(vector_d) - 1)
+    score = rw_cov_batch(matrix_d, matrices_s, sizes_s, size_n)
+    margin = normalization(sizes_s, size_n) * widths
+    return score - margin, score + margin
+
+def refinement_ranges(dataset: Subgroup, item: Subgroup):
+    """
+    Smallest and largest value every entry of the preference matrix of any refinement of a subgroup can take.
+
+    An aggregated entry lies between the smallest and largest value that entry takes in the rows of the
+    subgroup (a pair missing from some rows can become -1 in a mode matrix). The diagonal is always 0.
+    """
+    num_labels = len(dataset.pm.pm)
+    if item.stats is None:
+        lowest, highest = np.full((num_labels, num_labels), -1.), np.ones((num_labels, num_labels))
+    else:
+        stats = item.stats
+        missing = stats.count < stats.size
+        upper = np.triu_indices(num_labels, k=1)
+        lowest, highest = np.zeros((num_labels, num_labels)), np.zeros((num_labels, num_labels))
+        # In the lower triangle the roles of -1 and 1 are swapped
+        for triangle, negative, positive in ((upper, stats.negative, stats.positive),
+                                             ((upper[1], upper[0]), stats.positive, stats.negative)):
+            lowest[triangle] = np.where((negative > 0) | missing, -1, np.where(stats.tie > 0, 0, 1))
+            highest[triangle] = np.where(positive > 0, 1, np.where(stats.tie > 0, 0, -1))
+    np.fill_diagonal(lowest, 0)
+    np.fill_diagonal(highest, 0)
+    return lowest, highest
+
+def maximal_distance_matrix(dataset: Subgroup, item: Subgroup):
+    # Largest possible absolute distance per pair for any refinement of a subgroup
+    lowest, highest = refinement_ranges(dataset, item)
+    matrix_d = dataset.pm.pm
+    distances = .5 * np.maximum(np.abs(matrix_d - lowest), np.abs(matrix_d - highest))
+    np.fill_diagonal(distances, 0)
+    return distances
+
+def batch_distance_matrices(matrix_d: np.ndarray, matrices_s: np.ndarray):
+    return .5 * (matrix_d[np.newaxis] - matrices_s)
+
+def normalization(sizes_s: np.ndarray, size_n: int):
+    return np.sqrt(np.asarray(sizes_s) / size_n)
+
+def single(batch_function, dataset: Subgroup, item: Subgroup):
+    # Evaluate a single subgroup with a batch quality measure
+    return batch_function(dataset.pm.pm, item.pm.pm[np.newaxis], np.array([item.size]), dataset.size)[0]
 
 def split(dataset: Subgroup, item: Subgroup):
 
-    size_n = dataset.data.shape[0]
-    size_s = item.data.shape[0]
+    size_n = dataset.size
+    size_s = item.size
 
     return np.sqrt(size_s/size_n), dataset.pm, item.pm
 
@@ -107,4 +292,29 @@ metrics = dict(
     rw_cov=rw_cov,
     lw_norm=lw_norm,
     pw_max=pw_max
-)
\ No newline at end of file
+)
+
+batch_metrics = dict(
+    rw_norm=rw_norm_batch,
+    rw_norm_mode=rw_norm_batch,
+    rw_cov=rw_cov_batch,
+    lw_norm=lw_norm_batch,
+    pw_max=pw_max_batch
+)
+
+# Refinements are never larger than the refined subgroup, so these bounds only shrink with its size
+optimistic_estimates = dict(
+    rw_norm=rw_norm_estimate,
+    rw_norm_mode=rw_norm_estimate,
+    rw_cov=rw_cov_estimate,
+    lw_norm=lw_norm_estimate,
+    pw_max=pw_max_estimate
+)
+
+# Bounds on the score of subgroups of which the preference matrix is estimated, used by the approximate search
+score_bounds = dict(
+    rw_norm=monotone_bounds(rw_norm_batch),
+    rw_cov=rw_cov_bounds,
+    lw_norm=monotone_bounds(lw_norm_batch),
+    pw_max=monotone_bounds(pw_max_batch)
+)
@@ -0,0 +1,219 @@
+import math
+
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import List
+
+import numpy as np
+
+from epm.algorithm import Algorithm
+from epm.bitset import Bitset
+from epm.description import Description, DescriptionRegistry
+from epm.preference_matrix import PreferenceStats
+from epm.stats import DepthStats
+from epm.subgroup import Subgroup
+
+CHUNKS_PER_JOB = 16  # Tasks per process and level, the search checks its budget between tasks
+
+class SharedArray:
+    """
+    NumPy array in shared memory, attached by other processes through its `spec`.
+    """
+
+    def __init__(self, shm: SharedMemory, shape, dtype, owner: bool):
+        self.shm = shm
+        self.owner = owner
+        self.array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, array: np.ndarray):
+        shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = cls(shm, array.shape, array.dtype, owner=True)
+        shared.array[...] = array
+        return shared
+
+    @classmethod
+    def attach(cls, spec):
+        name, shape, dtype = spec
+        try:
+            shm = SharedMemory(name=name, track=False)  # Python >= 3.13, the creator owns the block
+        except TypeError:
+            shm = SharedMemory(name=name)
+        shared = cls(shm, shape, np.dtype(dtype), owner=False)
+        shared.array.flags.writeable = False
+        return shared
+
+    @property
+    def spec(self):
+        return self.shm.name, self.array.shape, self.array.dtype.str
+
+    def close(self):
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class MappedArray:
+    """
+    Memory-mapped array shared with other processes through its file instead of a copy.
+    """
+
+    def __init__(self, array: np.memmap):
+        self.array = array
+
+    @classmethod
+    def attach(cls, spec):
+        _, filename, shape, dtype, offset = spec
+        return cls(np.memmap(filename, dtype=np.dtype(dtype), mode='r', shape=shape, offset=offset))
+
+    @property
+    def spec(self):
+        return 'file', self.array.filename, self.array.shape, self.array.dtype.str, self.array.offset
+
+    def close(self):
+        self.array = None
+
+def share_array(array: np.ndarray):
+    if isinstance(array, np.memmap) and array.filename is not None:
+        return MappedArray(array)
+    return SharedArray.create(array)
+
+def attach_array(spec):
+    if spec[0] == 'file':
+        return MappedArray.attach(spec)
+    return SharedArray.attach(spec)
+
+class RefinementWorker(Algorithm):
+    """
+    Algorithm running in a pool process: it refines and scores the candidates
+    of a task, but leaves the duplicate check, the thresholds and the candidate
+    queue to the search in the parent process.
+    """
+
+    def evaluate_pending(self):
+        pending, self.pending = self.pending, []
+        self.score(pending)
+        self.refined.extend(pending)
+
+    def run_task(self, task):
+        self.refined = []
+        self.constructed_descriptions = DescriptionRegistry()
+        self.depth_stats = DepthStats()
+        if self.evaluation_cache is not None:
+            self.evaluation_cache.hits = self.evaluation_cache.misses = 0
+        task()
+        self.evaluate_pending()
+        cache_counts = (0, 0) if self.evaluation_cache is None else (self.evaluation_cache.hits, self.evaluation_cache.misses)
+        return self.refined, self.depth_stats, cache_counts
+
+_worker = None
+_shared = dict()
+
+def _init_worker(settings, dataset, preferences_spec, index, evaluation_function, batch_evaluation_function,
+                 evaluation_cache, fingerprint):
+    global _worker
+    _shared['preferences'] = attach_array(preferences_spec)
+    _worker = RefinementWorker(settings, dataset, evaluation_function, _shared['preferences'].array, index,
+                               batch_evaluation_function)
+    # Read only, the search process stores the subgroups the workers evaluate
+    _worker.evaluation_cache = evaluation_cache
+    _worker.fingerprint = fingerprint
+
+def _level_subgroup(level_spec, index: int, description: Description):
+    # Rebuild a parent subgroup from the level arrays shared by the search process
+    if 'level' not in _shared or _shared['level'][0].spec != level_spec[0]:
+        if 'level' in _shared:
+            for shared in _shared['level']:
+                shared.close()
+        _shared['level'] = [SharedArray.attach(spec) for spec in level_spec]
+    words, counts = (shared.array for shared in _shared['level'])
+    parent_counts = counts[index].copy()
+    stats = PreferenceStats(parent_counts[0], parent_counts[1], parent_counts[2], int(parent_counts[3, 0]))
+    rows = Bitset(words[index].copy(), _worker.dataset.size)
+    return Subgroup(_worker.dataset.source, description, stats=stats, rows=rows)
+
+def _refine(task):
+    level_spec, refinements = task
+    def refine():
+        for index, description, columns in refinements:
+            parent = _level_subgroup(level_spec, index, description)
+            for column in columns:
+                _worker.create_subgroups(parent, column)
+    return _worker.run_task(refine)
+
+def _join(task):
+    level_spec, pairs = task
+    def join():
+        for i, j, description, new_desc in pairs:
+            _worker.merge_subgroups(_level_subgroup(level_spec, i, description[0]),
+                                    _level_subgroup(level_spec, j, description[1]), new_desc)
+    return _worker.run_task(join)
+
+class ParallelRefiner:
+    """
+    Pool of processes refining and scoring the subgroups of a search level.
+
+    The preference tensor and the bitsets/statistics of the parents of a level
+    are placed in shared memory, tasks only carry row indices and descriptions.
+    Results come back in the order the serial search would generate them.
+    """
+
+    def __init__(self, algorithm: Algorithm, n_jobs: int):
+        self.algorithm = algorithm
+        self.n_jobs = n_jobs
+        # A memory-mapped tensor is mapped by the workers from its file, other tensors are copied to shared memory
+        self.preferences = share_array(algorithm.preferences)
+        # The workers get the cached evaluations of the dataset as they are when the search starts
+        evaluation_cache = None
+        if algorithm.evaluation_cache is not None:
+            evaluation_cache = algorithm.evaluation_cache.subset(algorithm.fingerprint, algorithm.settings['aggregate_technique'])
+        self.executor = ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_init_worker,
+            initargs=(algorithm.settings, algorithm.dataset, self.preferences.spec, algorithm.index,
+                      algorithm.evaluation_function, algorithm.batch_evaluation_function, evaluation_cache,
+                      algorithm.fingerprint))
+
+    def share_level(self, subgroups: List[Subgroup]):
+        words = np.stack([s.rows.words for s in subgroups])
+        # Per subgroup the -1/0/1 counts and (broadcast) the size
+        counts = np.stack([np.stack([s.stats.negative, s.stats.tie, s.stats.positive,
+                                     np.full_like(s.stats.negative, s.stats.size)]) for s in subgroups])
+        return [SharedArray.create(words), SharedArray.create(counts)]
+
+    def chunks(self, items: list):
+        size = max(1, math.ceil(len(items) / (self.n_jobs * CHUNKS_PER_JOB)))
+        return [items[i:i + size] for i in range(0, len(items), size)]
+
+    def run(self, function, subgroups: List[Subgroup], items: list):
+        # Generator, yields the results of the tasks in order
+        if len(items) == 0:
+            return
+        level = self.share_level(subgroups)
+        try:
+            level_spec = [shared.spec for shared in level]
+            for refined, depth_stats, (hits, misses) in self.executor.map(function, [(level_spec, chunk) for chunk in self.chunks(items)]):
+                self.algorithm.depth_stats.add_counts(depth_stats)
+                if self.algorithm.evaluation_cache is not None:
+                    self.algorithm.evaluation_cache.hits += hits
+                    self.algorithm.evaluation_cache.misses += misses
+                yield refined
+        finally:
+            for shared in level:
+                shared.close()
+
+    def refine(self, parents: List[Subgroup], descriptive_cols: List[str]):
+        # Split by parent subgroup, or by column when there are too few parents for the tasks of a level
+        if len(parents) >= self.n_jobs * CHUNKS_PER_JOB:
+            items = [(index, parent.description, descriptive_cols) for index, parent in enumerate(parents)]
+        else:
+            items = [(index, parent.description, [col]) for index, parent in enumerate(parents) for col in descriptive_cols]
+        return self.run(_refine, parents, items)
+
+    def join(self, itemsets: List[Subgroup], candidates: list):
+        items = [(i, j, (itemsets[i].description, itemsets[j].description), new_desc) for i, j, new_desc in candidates]
+        return self.run(_join, itemsets, items)
+
+    def close(self, wait: bool = True):
+        # Tasks left when the search stopped early are cancelled, without `wait` the running ones finish in the background
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+        self.preferences.close()
@@ -1,14 +1,109 @@
-from typing import List
+import re
+
+from typing import Iterable, List, Tuple
 from dataclasses import dataclass
+from functools import lru_cache
 
 import numpy as np
+import pandas as pd
 
 @dataclass
 class PM:
     pm: np.ndarray
 
     def __hash__(self):
-        return hash(self.pm.tostring())
+        return hash(self.pm.tobytes())
+
+TIE_SEPARATORS = re.compile(r'[=,]')
+
+def _tier_pieces(tier: str):
+    return [piece.strip() for piece in TIE_SEPARATORS.split(tier) if piece.strip()]
+
+def ranking_labels(rankings: Iterable[str]):
+    """
+    Infer the sorted set of labels used in a collection of rankings.
+
+    Ties are written either with an explicit separator ('a>b=c>d' or 'a>b,c>d') or,
+    for single character labels, by concatenation ('a>bc>d'). Labels of more than one
+    character are only inferred from rankings that write their ties with a separator,
+    otherwise every character is a label. Rankings that can be read either way raise a
+    ValueError, pass the labels to read them.
+
+    Parameters:
+        rankings (Iterable[str]) - Rankings in the format 'a>b>c>d'
+
+    Returns:
+        labels (List[str]) - Sorted list of labels
+    """
+    pieces = set()
+    separated = False
+    for ranking in rankings:
+        if not isinstance(ranking, str):
+            continue  # Missing ranking
+        separated = separated or TIE_SEPARATORS.search(ranking) is not None
+        for tier in ranking.split('>'):
+            pieces.update(_tier_pieces(tier))
+
+    if not separated:
+        for piece in pieces:
+            if len(set(piece)) < len(piece):
+                raise ValueError(f"`{piece}` is neither a tie of single character labels nor a label in rankings "
+                                 f"without separators, separate ties with '=' or pass the labels")
+        return sorted({char for piece in pieces for char in piece})
+
+    singles = {piece for piece in pieces if len(piece) == 1}
+    for piece in pieces:
+        if len(piece) > 1 and all(char in singles for char in piece):
+            raise ValueError(f"`{piece}` is either a label or a tie of {', '.join(piece)}, "
+                             f"separate all ties with '=' or pass the labels")
+    return sorted(pieces)
+
+@lru_cache(maxsize=2**16)
+def _parse_ranking(ranking: str, labels: Tuple[str]):
+    index = {label: i for i, label in enumerate(labels)}
+    positions = np.full(len(labels), np.nan, dtype=np.float32)
+    for rank, tier in enumerate(ranking.split('>')):
+        for piece in _tier_pieces(tier):
+            if piece in index:
+                positions[index[piece]] = rank
+            elif all(char in index for char in piece):
+                positions[[index[char] for char in piece]] = rank
+            else:
+                raise ValueError(f"Unknown label `{piece}` in ranking `{ranking}`")
+    positions.flags.writeable = False
+    return positions
+
+def rank_positions(rankings: Iterable[str], labels: List[str]):
+    """
+    Convert rankings to arrays holding the rank (tier index) of every label.
+
+    Parameters:
+        rankings (Iterable[str]) - Rankings in the format 'a>b>c>d'
+        labels (List[str]) - List of labels
+
+    Returns:
+        positions (np.ndarray) - Array of shape (n_rows, L), NaN for labels missing from a ranking
+    """
+    labels = tuple(labels)
+    positions = np.full((len(rankings), len(labels)), np.nan, dtype=np.float32)
+    for row, ranking in enumerate(rankings):
+        if isinstance(ranking, str):
+            positions[row] = _parse_ranking(ranking, labels)
+    return positions
+
+def positions_to_tensor(positions: np.ndarray):
+    """
+    Convert rank positions to a packed preference tensor.
+
+    Parameters:
+        positions (np.ndarray) - Rank positions of shape (n_rows, L)
+
+    Returns:
+        tensor (np.ndarray) - Packed preference tensor of shape (n_rows, L*(L-1)/2)
+    """
+    upper = np.triu_indices(positions.shape[1], k=1)
+    # 1 when the first label of the pair is ranked higher, -1 when lower, 0 on a tie, NaN when missing
+    return np.sign(positions[:, upper[1]] - positions[:, upper[0]])
 
 def ranking_to_preference_matrix(ranking, labels):
     """
@@ -21,78 +116,197 @@ def ranking_to_preference_matrix(ranking, labels):
     Returns:
         matrix (np.ndarray) - Preference Matrix
     """
-    # Create matrix
-    num_labels = len(labels)
-    matrix = np.zeros((num_labels, num_labels))
+    tensor = positions_to_tensor(rank_positions([ranking], labels))
+    return PM(unpack_preference_matrix(tensor[0], len(labels)))
 
-    # Fill matrix
-    elements = ranking.split('>')
-    for row, label1 in enumerate(labels):
-        for col, label2 in enumerate(labels):
-            if col <= row:
-                continue  # Skip lower triangular part and diagonal
-            
-            rank1 = next((index for index, item in enumerate(elements) if label1 in item), None)
-            rank2 = next((index for index, item in enumerate(elements) if label2 in item), None)
-            
-            if rank1 is None or rank2 is None:
-                matrix[row, col] = np.nan
-            elif rank1 < rank2:
-                matrix[row, col] = 1
-                matrix[col, row] = -1
-            elif rank1 > rank2:
-                matrix[row, col] = -1
-                matrix[col, row] = 1
-
-    return PM(matrix)
-
-def aggregate_preference_matrix(preference_matrices: List[PM], technique: str):
-    """
-    Calculate the (nan)mean or mode preference matrix of a list of preference matrices.
+def preference_tensor(rankings: Iterable[str], labels: List[str] = None):
+    """
+    Convert a column of rankings to a packed preference tensor.
+
+    Preference matrices are antisymmetric with a zero diagonal, so only the
+    strict upper triangle is stored: one row of L*(L-1)/2 cells per ranking.
+    Every distinct ranking is parsed only once.
 
     Parameters:
-        preference_matrices (List[np.ndarray]) - List of preference matrices
-        technique (str) - Technique to aggregate preference matrices
+        rankings (Iterable[str]) - Rankings in the format 'a>b>c>d'
+        labels (List[str]) - List of labels, inferred from the rankings when not given
 
     Returns:
-        mean_preference_matrix (np.ndarray) - Mean preference matrix
+        tensor (np.ndarray) - Packed preference tensor of shape (n_rows, L*(L-1)/2)
+        labels (List[str]) - List of labels
     """
-    pms = [pm.pm for pm in preference_matrices]
+    codes, uniques = pd.factorize(pd.Series(rankings, dtype=object))
+    if labels is None:
+        labels = ranking_labels(uniques)
 
-    if technique == 'mean':
-        return PM(np.nanmean(pms, axis=0))
-    elif technique == 'mode':
-        return matrix_mode(pms)
-    else:
-        raise ValueError(f"Invalid aggregate technique: `{technique}`")
+    unique_tensor = positions_to_tensor(rank_positions(list(uniques), labels))
+    # Missing rankings get code -1, which selects the all-NaN row appended at the end
+    unique_tensor = np.vstack([unique_tensor, np.full((1, unique_tensor.shape[1]), np.nan, dtype=np.float32)])
+    return unique_tensor[codes], labels
 
-def matrix_mode(preference_matrices: List[np.ndarray]):
+def num_labels_of(tensor: np.ndarray):
     """
-    Calculate the mode preference matrix of a list of preference matrices.
+    Recover the number of labels L from a packed tensor with L*(L-1)/2 cells per row.
+    """
+    cells = tensor.shape[-1]
+    return int(round((1 + np.sqrt(1 + 8 * cells)) / 2))
+
+def unpack_preference_matrix(vector: np.ndarray, num_labels: int):
+    """
+    Expand a packed upper triangle into the full antisymmetric preference matrix.
 
     Parameters:
-        preference_matrices (List[np.ndarray]) - List of preference matrices
+        vector (np.ndarray) - Packed upper triangle of length L*(L-1)/2
+        num_labels (int) - Number of labels L
 
     Returns:
-        mode_preference_matrix (np.ndarray) - Mode preference matrix
+        matrix (np.ndarray) - Preference matrix of shape (L, L)
+    """
+    upper = np.triu_indices(num_labels, k=1)
+    matrix = np.zeros((num_labels, num_labels))
+    matrix[upper] = vector
+    matrix[upper[1], upper[0]] = -matrix[upper]
+    return matrix
+
+@dataclass
+class PreferenceStats:
+    """
+    Sufficient statistics of a set of packed preference matrices.
+
+    Holds per upper-triangle cell the number of -1, 0 and 1 entries (NaN entries are
+    not counted) and the number of rows. Both the mean and the mode preference matrix
+    follow from these counts, and since the counts are additive the statistics of a
+    subgroup can be combined from, or complemented against, the statistics of others.
+    """
+    negative: np.ndarray
+    tie: np.ndarray
+    positive: np.ndarray
+    size: int
+
+    @classmethod
+    def from_tensor(cls, preferences: np.ndarray):
+        return cls(
+            np.count_nonzero(preferences == -1, axis=0),
+            np.count_nonzero(preferences == 0, axis=0),
+            np.count_nonzero(preferences == 1, axis=0),
+            len(preferences)
+        )
+
+    @property
+    def count(self):
+        # Number of non-NaN entries per cell
+        return self.negative + self.tie + self.positive
+
+    @property
+    def num_labels(self):
+        return num_labels_of(self.negative)
+
+    def __add__(self, other: 'PreferenceStats'):
+        return PreferenceStats(self.negative + other.negative, self.tie + other.tie,
+                               self.positive + other.positive, self.size + other.size)
+
+    def __sub__(self, other: 'PreferenceStats'):
+        return PreferenceStats(self.negative - other.negative, self.tie - other.tie,
+                               self.positive - other.positive, self.size - other.size)
+
+    def mean(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (self.positive - self.negative) / self.count
+        return PM(unpack_preference_matrix(mean, self.num_labels))
+
+    def mode(self):
+        num_labels = self.num_labels
+        upper = np.triu_indices(num_labels, k=1)
+
+        # Mirror the upper counts into full count matrices, the lower triangle swaps -1 and 1
+        upper_counts = [self.negative, self.tie, self.positive]
+        counts = np.zeros((3, num_labels, num_labels), dtype=np.int64)
+        for value in range(3):
+            counts[value][upper] = upper_counts[value]
+            counts[2 - value][upper[1], upper[0]] = upper_counts[value]
+        counts[1][np.diag_indices(num_labels)] = self.size
+
+        # Determine the mode along the third axis
+        mode_indices = np.argmax(counts, axis=0)
+
+        # Map mode indices to corresponding values (-1, 0, 1)
+        return PM(np.choose(mode_indices, [-1, 0, 1]))
+
+    def aggregate(self, technique: str):
+        if technique == 'mean':
+            return self.mean()
+        elif technique == 'mode':
+            return self.mode()
+        else:
+            raise ValueError(f"Invalid aggregate technique: `{technique}`")
+
+class IntervalStats:
+    """
+    Preference statistics of the rows `lower < value <= upper`, `value >= lower` and `value <= upper`
+    for any edges of a numerical column, from a single pass over the rows.
+
+    The rows are grouped on their position relative to the edges: strictly between two edges (even
+    groups) or equal to an edge (odd groups). The counts are accumulated over the groups in order, so
+    the statistics of an interval are the difference of two cumulative counts. Rows with a missing
+    value are in no interval.
+
+    Parameters:
+        preferences (np.ndarray) - Packed preference tensor of the dataset
+        rows (np.ndarray) - Positions of the rows in the dataset
+        values (np.ndarray) - Values of the column in these rows
+        edges (List[float]) - Sorted edges of the column
+        backend (NumpyBackend) - Compute backend counting the groups
+    """
+
+    def __init__(self, preferences: np.ndarray, rows: np.ndarray, values: np.ndarray, edges: List[float], backend):
+        self.positions = {edge: position for position, edge in enumerate(edges)}
+        edges = np.asarray(edges, dtype=np.float64)
+        values = np.asarray(values, dtype=np.float64)
+        present = ~np.isnan(values)
+        values = values[present]
+        left = np.searchsorted(edges, values, side='left')
+        groups = 2 * left + (np.searchsorted(edges, values, side='right') > left)
+
+        sizes = np.bincount(groups, minlength=2 * len(edges) + 1)
+        counts = np.zeros((3, len(sizes) + 1, preferences.shape[1]), dtype=np.int64)
+        counts[:, 1:] = backend.count_groups(preferences, rows[present], groups, len(sizes))
+        self.counts = np.cumsum(counts, axis=1)
+        self.sizes = np.concatenate([[0], np.cumsum(sizes)])
+
+    def range(self, start: int, stop: int):
+        # Statistics of the groups start up to (not including) stop
+        negative, tie, positive = self.counts[:, stop] - self.counts[:, start]
+        return PreferenceStats(negative, tie, positive, int(self.sizes[stop] - self.sizes[start]))
+
+    def __call__(self, lower: float = None, upper: float = None):
+        start = 0 if lower is None else 2 * self.positions[lower] + (1 if upper is None else 2)
+        stop = len(self.sizes) - 1 if upper is None else 2 * self.positions[upper] + 2
+        return self.range(start, stop)
+
+def aggregate_preference_matrix(preferences: np.ndarray, technique: str):
+    """
+    Calculate the (nan)mean or mode preference matrix of a packed preference tensor.
+
+    Parameters:
+        preferences (np.ndarray) - Packed preference tensor of shape (n_rows, L*(L-1)/2)
+        technique (str) - Technique to aggregate preference matrices
+
+    Returns:
+        mean_preference_matrix (np.ndarray) - Mean preference matrix
     """
-    # Stack the matrices along a new axis to create a 3D array
-    stacked_matrices = np.stack(preference_matrices)
+    return PreferenceStats.from_tensor(preferences).aggregate(technique)
 
-    # Count occurrences of -1, 0, and 1 in the stacked matrices
-    counts = np.stack([
-        np.sum(stacked_matrices == -1, axis=0),
-        np.sum(stacked_matrices == 0, axis=0),
-        np.sum(stacked_matrices == 1, axis=0)
-    ], axis=0)
+def matrix_mode(preferences: np.ndarray):
+    """
+    Calculate the mode preference matrix of a packed preference tensor.
 
-    # Determine the mode along the third axis
-    mode_indices = np.argmax(counts, axis=0)
-    
-    # Map mode indices to corresponding values (-1, 0, 1)
-    mode_preference_matrix = np.choose(mode_indices, [-1, 0, 1])
+    Parameters:
+        preferences (np.ndarray) - Packed preference tensor of shape (n_rows, L*(L-1)/2)
 
-    return PM(mode_preference_matrix)
+    Returns:
+        mode_preference_matrix (np.ndarray) - Mode preference matrix
+    """
+    return PreferenceStats.from_tensor(preferences).mode()
 
 def distance_matrix(matrix_d: PM, matrix_s: PM):
     """
@@ -106,4 +320,4 @@ def distance_matrix(matrix_d: PM, matrix_s: PM):
     Returns:
         matrix_l (np.ndarray) - Distance matrix
     """
-    return .5 * (matrix_d.pm - matrix_s.pm)
\ No newline at end of file
+    return .5 * (matrix_d.pm - matrix_s.pm)
@@ -0,0 +1,58 @@
+from statistics import NormalDist
+
+import numpy as np
+
+from epm.bitset import Bitset
+from epm.preference_matrix import PreferenceStats, unpack_preference_matrix
+
+MIN_NORMAL = 30  # Sampled entries of a pair needed to rely on the normal approximation
+
+def stratified_sample(preferences: np.ndarray, fraction: float, seed: int = 0):
+    """
+    Sample a fraction of the rows, stratified on the ranking.
+
+    The rows are shuffled, grouped by their ranking and then every (1 / fraction)-th row is taken,
+    so every ranking keeps its share of the sample, also when it occurs only a few times.
+
+    Parameters:
+        preferences (np.ndarray) - Packed preference tensor of shape (n_rows, L*(L-1)/2)
+        fraction (float) - Fraction of the rows to sample, in (0, 1]
+        seed (int) - Seed of the random generator
+
+    Returns:
+        sample (Bitset) - Rows in the sample
+    """
+    if not 0 < fraction <= 1:
+        raise ValueError("The sample fraction should be in (0, 1]")
+    size = len(preferences)
+    rng = np.random.default_rng(seed)
+    # Equal rankings have equal bytes, missing pairs included
+    rows = np.ascontiguousarray(preferences).view(np.dtype((np.void, preferences.dtype.itemsize * preferences.shape[1])))
+    _, strata = np.unique(rows.reshape(-1), return_inverse=True)
+    order = rng.permutation(size)
+    order = order[np.argsort(strata.reshape(-1)[order], kind='stable')]
+    positions = np.floor(np.arange(rng.uniform(0, 1 / fraction), size, 1 / fraction)).astype(np.int64)
+    return Bitset.from_indices(order[positions[positions < size]], size)
+
+def half_widths(estimate: PreferenceStats, confidence: float):
+    """
+    Half widths of the confidence intervals of the mean preference matrix estimated from a sample of the
+    rows of a subgroup.
+
+    The confidence is shared over the pairs. A pair sampled at least `MIN_NORMAL` times gets the normal
+    interval of its sample mean, a pair sampled less often the Hoeffding bound, and a pair without
+    sampled entries an infinite half width.
+
+    Returns:
+        half_widths (np.ndarray) - Half width per entry of the preference matrix, of shape (L, L)
+    """
+    count = estimate.count
+    delta = (1 - confidence) / len(count)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (estimate.positive - estimate.negative) / count
+        variance = np.maximum((estimate.positive + estimate.negative) / count - mean ** 2, 0)
+        normal = NormalDist().inv_cdf(1 - delta / 2) * np.sqrt(variance / count)
+        hoeffding = np.sqrt(2 * np.log(2 / delta) / count)
+    widths = np.minimum(np.where(count >= MIN_NORMAL, normal, hoeffding), 2)
+    widths[count == 0] = np.inf
+    return np.abs(unpack_preference_matrix(widths, estimate.num_labels))
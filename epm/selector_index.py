@@ -0,0 +1,141 @@
+import logging
+
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from epm.bitset import Bitset
+from epm.dataset import Dataset, encode_categorical
+
+def bin_edges(data: np.ndarray, n_bins: int, bin_strategy: str):
+    if bin_strategy == 'equidepth':
+        _, intervals = pd.qcut(data, q=n_bins, duplicates='drop', retbins=True)
+    elif bin_strategy == 'equiwidth':
+        _, intervals = pd.cut(data, bins=n_bins, duplicates='drop', retbins=True)
+    else:
+        raise ValueError(f"Invalid bin strategy `{bin_strategy}`")
+    return list(intervals)
+
+class CategoricalSelectors:
+    """
+    Selectors `column = value` of a categorical column, one row bitset per value.
+    """
+    kind = 'categorical'
+
+    def __init__(self, data: np.ndarray, missing=None):
+        # Codes follow the order of appearance, missing values get code -1 and no selector
+        self.missing = missing  # Value marking a missing value besides NaN, -1 in a column of category codes
+        self.size = len(data)
+        codes, values = pd.factorize(data)
+        self.values = list(values)
+        if missing in self.values:
+            dropped = self.values.index(missing)
+            codes = np.where(codes == dropped, -1, codes - (codes > dropped))
+            del self.values[dropped]
+        self.masks = [Bitset.from_mask(codes == code) for code in range(len(self.values))]
+
+    def append(self, data: np.ndarray):
+        # Rows appended to the column, values not seen before get the next codes
+        known = {value: code for code, value in enumerate(self.values)}
+        present = np.asarray(data != self.missing) if self.missing is not None else np.ones(len(data), dtype=bool)
+        codes = np.full(len(data), -1, dtype=np.int64)
+        codes[present] = encode_categorical(data[present], known)
+        length = self.size
+        self.values = list(known)
+        self.size += len(data)
+        self.masks += [Bitset(np.zeros((length + 7) // 8, dtype=np.uint8), length, 0)
+                       for _ in range(len(self.values) - len(self.masks))]
+        self.masks = [mask.extend(codes == code) for code, mask in enumerate(self.masks)]
+
+class NumericSelectors:
+    """
+    Selectors of a numerical column: bins `lower < column <= upper` and splits
+    `column >= edge` / `column <= edge` on bin edges of the whole column.
+    """
+    kind = 'numeric'
+
+    def __init__(self, data: np.ndarray, n_bins: int, bin_strategy: str, bin_subgroups: str):
+        self.data = data
+        self.edges = bin_edges(np.asarray(data, dtype=np.float64), n_bins, bin_strategy)
+
+        self.bins = []
+        if bin_subgroups == 'both' or bin_subgroups == 'per_bin':
+            # With both kinds of subgroups the outer bins are covered by the splits
+            bounds = self.edges[1:-1] if bin_subgroups == 'both' else self.edges
+            self.bins = [(lower, upper, Bitset.from_mask((data > lower) & (data <= upper)))
+                         for lower, upper in zip(bounds[:-1], bounds[1:])]
+        self.splits = []
+        if bin_subgroups == 'both' or bin_subgroups == 'per_split':
+            self.splits = [(edge, Bitset.from_mask(data >= edge), Bitset.from_mask(data <= edge))
+                           for edge in self.edges[1:-1]]
+
+    def append(self, data: np.ndarray):
+        # Rows appended to the column are placed in the bins and splits of the existing edges
+        self.bins = [(lower, upper, mask.extend((data > lower) & (data <= upper))) for lower, upper, mask in self.bins]
+        self.splits = [(edge, greater.extend(data >= edge), less.extend(data <= edge))
+                       for edge, greater, less in self.splits]
+
+    def single_valued(self, rows: Bitset):
+        values = self.data[rows.to_mask()]
+        return len(values) > 0 and values.min() == values.max()
+
+class SelectorIndex:
+    """
+    Discretization of every descriptive column and the row bitsets of all their
+    selectors over the whole dataset, built once when the data is loaded.
+    A refinement of a subgroup is then its bitset AND a selector bitset.
+    """
+
+    def __init__(self, data: Dataset, settings: dict, columns: List[str] = None):
+        if columns is None:
+            columns = data.column_names
+        self.columns = dict()
+        for column in columns:
+            values = data[column]
+            if column in settings['object_cols'] or len(pd.unique(values)) < settings['n_bins']:
+                self.columns[column] = CategoricalSelectors(values, -1 if column in settings['object_cols'] else None)
+            else:  # Float or Int
+                self.columns[column] = NumericSelectors(values, settings['n_bins'], settings['bin_strategy'],
+                                                        settings['bin_subgroups'])
+        logging.info(f"Indexed {sum(1 for s in self.columns.values() if s.kind == 'numeric')} numerical and "
+                     f"{sum(1 for s in self.columns.values() if s.kind == 'categorical')} categorical columns")
+
+    def append(self, data: Dataset, start: int):
+        """
+        Add the rows appended to the dataset `data` from position `start` to the selectors.
+
+        The discretization of the first load is kept, so the descriptions found before stay valid:
+        new rows are placed in the existing bins and new categorical values get selectors of their own.
+        """
+        for column, selectors in self.columns.items():
+            values = np.asarray(data[column][start:])
+            if selectors.kind == 'numeric':
+                selectors.data = data[column]
+            selectors.append(values)
+
+    def select(self, data: Dataset, description: Dict, start: int = 0):
+        """
+        Mask of the rows of `data` from position `start` on covered by an encoded description, given as
+        its dictionary of selectors.
+        """
+        mask = np.ones(len(data) - start, dtype=bool)
+        for column, value in description.items():
+            if column == 'all':
+                continue
+            values = np.asarray(data[column][start:])
+            if isinstance(value, (list, tuple)):
+                lower, upper = value
+                if lower is not None:
+                    mask &= (values > lower) if upper is not None else (values >= lower)
+                if upper is not None:
+                    mask &= values <= upper
+            else:
+                mask &= values == value
+        return mask
+
+    def __getitem__(self, column: str):
+        return self.columns[column]
+
+    def __contains__(self, column: str):
+        return column in self.columns
@@ -0,0 +1,221 @@
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+
+from concurrent.futures import ProcessPoolExecutor
+from http import HTTPStatus
+from typing import Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+from epm.EPM import EPM
+from epm.dataset import Dataset, content_key, load_cached
+from epm.evaluation_cache import EvaluationCache
+from epm.subgroup import Subgroup
+
+# Owned by the worker processes, not set per request. Searches run in parallel over the workers, a search of its own
+# process pool per request would multiply the processes by the workers
+LOCAL_SETTINGS = ('evaluation_cache', 'stats_callback', 'n_jobs')
+MAX_BODY = 1 << 20
+
+_datasets = dict()
+_indexes = dict()
+_cache = None
+
+def _init_worker(directories: Dict[str, str], cache_bytes: int):
+    global _cache
+    # The encoded arrays are mapped from the files the service wrote, every worker shares their pages
+    for name, directory in directories.items():
+        _datasets[name] = Dataset.load(directory)
+    if cache_bytes:
+        _cache = EvaluationCache(cache_bytes)
+        for name, data in _datasets.items():
+            # Hashed once here instead of in the first search
+            fingerprint = data.fingerprint
+            logging.debug(f"Dataset {name} has fingerprint {fingerprint}")
+
+def _ready():
+    return True
+
+def subgroup_dict(subgroup: Subgroup):
+    """
+    JSON serializable form of a subgroup with a decrypted description, intervals as [lower, upper].
+    NaN scores and matrix entries, of pairs no ranking of the subgroup compares, are null.
+    """
+    matrix = subgroup.pm.pm
+    return dict(
+        description={key: list(value) if isinstance(value, tuple) else value for key, value in subgroup.description.items()},
+        score=None if subgroup.score is None or np.isnan(subgroup.score) else subgroup.score,
+        size=subgroup.size,
+        coverage=subgroup.size / len(subgroup.source),
+        matrix=np.where(np.isnan(matrix), None, matrix).tolist()
+    )
+
+def _search(name: str, settings: dict, descriptive_cols: List[str], approximate: bool):
+    settings = dict(settings or {})
+    for setting in LOCAL_SETTINGS:
+        if setting in settings:
+            raise ValueError(f"The {setting} setting is not allowed in a request")
+    epm = EPM(evaluation_cache=_cache, **settings)
+    # Selector indexes are kept per binning, searches with the same binning skip discretizing the columns
+    key = (name, epm.settings['n_bins'], epm.settings['bin_strategy'], epm.settings['bin_subgroups'])
+    epm.prepare(_datasets[name], _indexes.get(key))
+    _indexes[key] = epm.index
+    epm.search(descriptive_cols, approximate)
+    return dict(
+        subgroups=[subgroup_dict(subgroup) for subgroup in epm.algorithm.subgroups],
+        stats=epm.stats.to_dict(),
+        truncated=epm.truncated
+    )
+
+def to_json(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class MiningService:
+    """
+    Local HTTP service running searches on datasets that stay loaded between requests.
+
+    Every dataset is encoded once when the service starts and stored as array files (in `cache_dir`,
+    a temporary directory when not given). A pool of `n_workers` processes maps these files and keeps
+    the datasets, the selector index per binning and optionally an evaluation cache of `cache_bytes`
+    in memory, so a request only pays for its search. Requests are handled concurrently, up to
+    `n_workers` searches run at the same time.
+
+    Endpoints:
+        GET /datasets - Rows, columns and labels per dataset
+        POST /search - Runs a search, the body is a JSON object with the name of the `dataset`, the
+            `settings` (keyword arguments of `EPM`), and optionally the `descriptive_cols` and
+            `approximate` arguments of `EPM.search`. Responds with the `subgroups` found, best first,
+            the search `stats` and whether the search was `truncated`
+    """
+
+    def __init__(self, datasets: Dict[str, Union[pd.DataFrame, str]], n_workers: int = 1, cache_dir: str = None,
+                 cache_bytes: int = None, labels: List[str] = None, chunksize: int = 100000):
+        self.temporary = tempfile.TemporaryDirectory(prefix='epm-service-') if cache_dir is None else None
+        cache_dir = self.temporary.name if cache_dir is None else cache_dir
+        self.directories = dict()
+        self.info = dict()
+        for name, data in datasets.items():
+            def build(data=data):
+                if isinstance(data, pd.DataFrame):
+                    return Dataset.from_frame(data, labels)
+                return Dataset.from_chunks(pd.read_csv(data, chunksize=chunksize), labels=labels)
+
+            logging.info(f"Loading dataset {name}...")
+            dataset = load_cached(cache_dir, content_key(data, labels), build)
+            self.directories[name] = dataset.directory
+            self.info[name] = dict(rows=len(dataset), columns=dataset.column_names, labels=list(dataset.labels))
+        self.n_workers = n_workers
+        self.executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                            initargs=(self.directories, cache_bytes))
+
+    async def search(self, dataset: str, settings: dict = None, descriptive_cols: List[str] = None,
+                     approximate: bool = False):
+        if dataset not in self.directories:
+            raise ValueError(f"No such dataset: {dataset}")
+        if isinstance(descriptive_cols, str):
+            descriptive_cols = [descriptive_cols]
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _search, dataset, settings, descriptive_cols, approximate)
+
+    async def dispatch(self, method: str, path: str, body: bytes):
+        if path == '/datasets':
+            if method != 'GET':
+                return HTTPStatus.METHOD_NOT_ALLOWED, dict(error=f"Use GET for {path}")
+            return HTTPStatus.OK, self.info
+        if path == '/search':
+            if method != 'POST':
+                return HTTPStatus.METHOD_NOT_ALLOWED, dict(error=f"Use POST for {path}")
+            request = json.loads(body or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("The request should be a JSON object")
+            if request.get('dataset') not in self.directories:
+                return HTTPStatus.NOT_FOUND, dict(error=f"No such dataset: {request.get('dataset')}")
+            return HTTPStatus.OK, await self.search(**request)
+        return HTTPStatus.NOT_FOUND, dict(error=f"No such endpoint: {path}")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Minimal HTTP/1.1, one request per connection
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+            headers = dict()
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY:
+                raise ValueError("Request body too large")
+            body = await reader.readexactly(length)
+            status, payload = await self.dispatch(method, target.split('?', 1)[0], body)
+        except (ValueError, TypeError, asyncio.IncompleteReadError) as e:
+            # Malformed requests and invalid settings, as raised by EPM
+            status, payload = HTTPStatus.BAD_REQUEST, dict(error=str(e))
+        except Exception as e:
+            logging.exception("Request failed")
+            status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, dict(error=str(e))
+        try:
+            content = json.dumps(payload, default=to_json, allow_nan=False).encode()
+        except ValueError as e:
+            # NaN or infinity left in the response, not valid JSON
+            logging.exception("Response not serializable")
+            status, content = HTTPStatus.INTERNAL_SERVER_ERROR, json.dumps(dict(error=str(e))).encode()
+        writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(content)}\r\nConnection: close\r\n\r\n".encode('latin-1') + content)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8765, path: str = None):
+        """
+        Start the worker processes and listen on `host`:`port`, or on the Unix socket `path` when given.
+        """
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, _ready) for _ in range(self.n_workers)))
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle, path)
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765, path: str = None):
+        server = await self.start(host, port, path)
+        logging.info(f"Serving {', '.join(self.directories)} on {path or f'{host}:{port}'}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        if self.temporary is not None:
+            self.temporary.cleanup()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve searches on datasets kept in memory")
+    parser.add_argument('--dataset', action='append', required=True, metavar='NAME=CSV',
+                        help="Name and CSV file of a dataset, repeat for more datasets")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help="Unix socket to listen on instead of a TCP port")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--cache-dir', help="Directory for the encoded datasets, a temporary directory when not given")
+    parser.add_argument('--cache-bytes', type=int, default=None, help="Size of the evaluation cache of every worker")
+    parser.add_argument('--log-level', type=int, default=logging.INFO)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    datasets = dict(dataset.split('=', 1) for dataset in args.dataset)
+    service = MiningService(datasets, args.workers, args.cache_dir, args.cache_bytes)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+if __name__ == '__main__':
+    main()
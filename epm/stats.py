@@ -0,0 +1,103 @@
+import os
+import sys
+
+from dataclasses import asdict, dataclass, field, fields
+from typing import List
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:  # Optional, only needed for the current memory where /proc is not available
+    psutil = None
+
+COUNTS = ('generated', 'duplicates', 'frequency_dropped', 'evaluated', 'verified', 'threshold_dropped', 'pruned',
+          'errors')
+TIMINGS = ('refinement', 'aggregation', 'evaluation', 'dedupe', 'selection')
+
+def peak_memory():
+    # Peak resident set size of the process in bytes, None when unknown
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def current_memory():
+    # Resident set size of the process in bytes right now, None when unknown
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    return None
+
+@dataclass
+class DepthStats:
+    """
+    Counters and timings (in seconds) of one depth step of the search.
+
+    `refinement` is the wall time of the step not spent in the other phases. With
+    n_jobs > 1 the work done in the pool is accounted as refinement, the counts of
+    the pool are included.
+    """
+    depth: int = None
+    wall: float = 0.0
+    refinement: float = 0.0
+    aggregation: float = 0.0
+    evaluation: float = 0.0
+    dedupe: float = 0.0
+    selection: float = 0.0
+    generated: int = 0  # Candidate descriptions constructed
+    duplicates: int = 0  # Candidates skipped as already constructed
+    frequency_dropped: int = 0  # Candidates below the frequency threshold
+    evaluated: int = 0  # Candidates scored
+    verified: int = 0  # Estimated candidates evaluated exactly in an approximate search
+    threshold_dropped: int = 0  # Scored candidates not passing the evaluation threshold
+    pruned: int = 0  # Subgroups not refined due to their optimistic estimate
+    errors: int = 0  # Candidates skipped due to an exception
+    peak_memory: int = None
+
+    def finish(self, wall: float):
+        self.wall = wall
+        self.refinement = max(0.0, wall - self.aggregation - self.evaluation - self.dedupe - self.selection)
+        self.peak_memory = peak_memory()
+
+    def add_counts(self, other: 'DepthStats'):
+        for name in COUNTS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def to_dict(self):
+        return asdict(self)
+
+@dataclass
+class SearchStats:
+    depths: List[DepthStats] = field(default_factory=list)
+
+    @property
+    def total(self):
+        total = DepthStats()
+        for depth in self.depths:
+            total.add_counts(depth)
+            for name in ('wall',) + TIMINGS:
+                setattr(total, name, getattr(total, name) + getattr(depth, name))
+        total.peak_memory = self.peak_memory
+        return total
+
+    @property
+    def peak_memory(self):
+        peaks = [depth.peak_memory for depth in self.depths if depth.peak_memory is not None]
+        return max(peaks) if peaks else None
+
+    def to_dict(self):
+        return dict(depths=[depth.to_dict() for depth in self.depths], total=self.total.to_dict())
+
+    def __str__(self):
+        names = [f.name for f in fields(DepthStats) if f.name not in ('depth', 'peak_memory')]
+        rows = [' '.join(f'{name}={getattr(depth, name):.3f}' if isinstance(getattr(depth, name), float)
+                         else f'{name}={getattr(depth, name)}' for name in names) for depth in self.depths]
+        return '\n'.join(f'Depth {depth.depth}: {row}' for depth, row in zip(self.depths, rows))
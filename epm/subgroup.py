@@ -1,24 +1,62 @@
 import logging
-import pandas as pd
 
+from copy import copy
+
+from epm.bitset import Bitset
+from epm.dataset import Dataset
 from epm.description import Description
-from epm.preference_matrix import PM
+from epm.preference_matrix import PM, PreferenceStats
 
 class Subgroup:
+    """
+    Part of the dataset covered by a description, with its statistics and score.
+
+    Subgroups only hold the row bitset and share their description with their
+    refinements, the data itself stays in the dataset.
+    """
+    __slots__ = ('source', 'rows', 'description', 'pm', 'coverage', 'stats', 'score', 'estimate')
 
-    def __init__(self, data: pd.DataFrame, description: Description, pm: PM = None, coverage: float = None):
-        self.data = data
+    def __init__(self, data: Dataset, description: Description, pm: PM = None, coverage: float = None,
+                 stats: PreferenceStats = None, rows: Bitset = None):
+        self.source = data  # The whole dataset, rows selects the part covered by the subgroup
+        self.rows = Bitset.full(len(data)) if rows is None else rows
         self.description = description
         self.pm = pm
         self.coverage = coverage
+        self.stats = stats
         self.score = None
+        self.estimate = None  # Statistics of the sampled rows while the score is estimated in an approximate search
+
+    def __getstate__(self):
+        # The dataset is not sent along when a subgroup is pickled, the receiver re-attaches it
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state['source'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     def decrypt_description(self, translation):
-        self.description.decrypt(translation)
+        self.description = self.description.decrypt(translation)
+
+    def decrypted(self, translation):
+        # Copy with a decrypted description, the description of the subgroup itself stays encoded
+        subgroup = copy(self)
+        subgroup.source = self.source  # Dropped by __getstate__
+        subgroup.decrypt_description(translation)
+        return subgroup
+
+    @property
+    def data(self):
+        # Only materialized on request, the search itself works on the row bitset
+        if self.rows.count == len(self.source):
+            return self.source.to_frame()
+        return self.source.take(self.rows.indices())
 
     @property
     def size(self):
-        return len(self.data)
+        return self.rows.count
     
     def to_string(self):
         descriptors = str(sorted(str(self.description).split(' && '))).replace(',', ' &&').replace('[', '').replace(']', '').replace("'", '')
@@ -0,0 +1,115 @@
+from typing import List, NamedTuple
+
+import numpy as np
+
+from epm.algorithm import Algorithm
+from epm.candidates import CandidateQueue
+from epm.metrics import metrics, batch_metrics
+from epm.subgroup import Subgroup
+
+class SweepConfig(NamedTuple):
+    metric: str
+    evaluation_threshold: float
+    frequency_threshold: float
+    depth: int
+
+def strategy_of(metric: str):
+    return 'minimize' if metric == 'rw_cov' else 'maximize'
+
+def technique_of(metric: str):
+    return 'mode' if metric == 'rw_norm_mode' else 'mean'
+
+def check_config(config: SweepConfig):
+    if config.metric not in batch_metrics:
+        raise ValueError(f"No such metric: {config.metric}")
+    if config.evaluation_threshold is None or config.frequency_threshold is None:
+        raise ValueError("Evaluation and frequency threshold should be specified for every configuration")
+    if strategy_of(config.metric) == 'minimize' and config.evaluation_threshold > 0:
+        raise ValueError("Evaluation threshold should be less than 0 for rw_cov")
+    if strategy_of(config.metric) == 'maximize' and config.evaluation_threshold < 0:
+        raise ValueError("Evaluation threshold should be greater than 0 when not using rw_cov")
+
+class LatticeAlgorithm(Algorithm):
+    """
+    Apriori search collecting every frequent subgroup instead of the ones passing an evaluation
+    threshold, so the results of several configurations can be derived from one lattice.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lattice = []
+
+    def score(self, subgroups: List[Subgroup]):
+        # Every metric is scored over the whole lattice once it is complete
+        pass
+
+    def admit(self, subgroup: Subgroup):
+        self.depth_stats.evaluated += 1
+        self.frequent_itemset.append(subgroup)
+        self.lattice.append(subgroup)
+
+class Sweep:
+    """
+    Results of several (metric, evaluation threshold, frequency threshold, depth) configurations from
+    one apriori lattice.
+
+    The lattice holds every subgroup frequent at the lowest frequency threshold, up to the largest
+    depth. Since frequency is anti-monotone, the subgroups an apriori search of a configuration would
+    construct are exactly the lattice subgroups covering enough rows and described by few enough
+    attributes. Every metric is scored once over the whole lattice.
+    """
+
+    def __init__(self, settings: dict, dataset: Subgroup, preferences: np.ndarray, index, configs: List[SweepConfig],
+                 evaluation_cache=None):
+        self.configs = [SweepConfig(*config) for config in configs]
+        if len(self.configs) == 0:
+            raise ValueError("No configurations to sweep")
+        for config in self.configs:
+            check_config(config)
+        self.dataset = dataset
+        self.settings = dict(settings, algorithm='apriori', strategy='maximize', width=None, candidate_size=None,
+                             evaluation_threshold=None, aggregate_technique='mean', evaluation_metric=None,
+                             frequency_threshold=min(config.frequency_threshold for config in self.configs),
+                             depth=max(config.depth for config in self.configs))
+        self.algorithm = LatticeAlgorithm(self.settings, dataset, metrics['rw_norm'], preferences, index,
+                                          batch_metrics['rw_norm'], evaluation_cache=evaluation_cache)
+        self.scores = dict()
+
+    def run(self, descriptive_cols: List[str]):
+        self.algorithm.run(descriptive_cols)
+        lattice = self.algorithm.lattice
+        for metric in dict.fromkeys(config.metric for config in self.configs):
+            self.scores[metric] = self.score(metric, lattice)
+
+    def score(self, metric: str, lattice: List[Subgroup]):
+        technique = technique_of(metric)
+        matrix_d = self.dataset.stats.aggregate(technique).pm
+        scores = np.empty(len(lattice))
+        for start in range(0, len(lattice), Algorithm.batch_size):
+            batch = lattice[start:start + Algorithm.batch_size]
+            if technique == 'mean':
+                matrices = np.stack([s.pm.pm for s in batch])
+            else:
+                matrices = np.stack([s.stats.aggregate(technique).pm for s in batch])
+            scores[start:start + len(batch)] = batch_metrics[metric](matrix_d, matrices, np.array([s.size for s in batch]),
+                                                                     self.dataset.size)
+        return scores
+
+    def results(self, config: SweepConfig, translation: dict):
+        """
+        Subgroups an apriori search with the configuration finds, best first, with decrypted descriptions.
+        """
+        strategy = strategy_of(config.metric)
+        technique = technique_of(config.metric)
+        candidates = CandidateQueue(strategy)
+        for subgroup, score in zip(self.algorithm.lattice, self.scores[config.metric]):
+            if subgroup.coverage < config.frequency_threshold or len(subgroup.description.key) > config.depth:
+                continue
+            if (strategy == 'maximize' and score > config.evaluation_threshold) or \
+                (strategy == 'minimize' and score < config.evaluation_threshold):
+                result = subgroup.decrypted(translation)
+                if technique != 'mean':
+                    result.pm = subgroup.stats.aggregate(technique)
+                result.score = score
+                candidates.push(result)
+        return candidates.best()
@@ -16,7 +16,7 @@ def downsize(data):
     translate = dict()
     for column in data.columns:
         if column != 'ranking':  # Skip the 'ranking' column
-            if data[column].dtype == object or data[column].dtype.name == 'category':
+            if data[column].dtype == object or data[column].dtype.name == 'category' or pd.api.types.is_string_dtype(data[column]):
                 data[column], translate[column] = pd.factorize(data[column])
             elif data[column].dtype in [np.int8, np.int16, np.int32, np.int64]:
                 data[column] = pd.to_numeric(data[column], downcast='unsigned')
@@ -1,6 +1,7 @@
 import pandas as pd
 
 from epm.EPM import EPM
+from epm.evaluation_cache import EvaluationCache
 
 def generateResults(dataset : str, eval_metric : str, depth : int, eval_threshold : int, frequency_threshold : int):
 
@@ -8,9 +9,11 @@ def generateResults(dataset : str, eval_metric : str, depth : int, eval_threshol
     df = pd.read_csv(path_data)
 
     num_descriptors = len(df) - 1
+    # Both searches evaluate many of the same descriptions
+    evaluation_cache = EvaluationCache()
 
     clf_apriori = EPM(depth = num_descriptors, evaluation_metric = eval_metric, bin_strategy = 'equiwidth', algorithm = 'apriori', 
-                    evaluation_threshold = eval_threshold, frequency_threshold = frequency_threshold)
+                    evaluation_threshold = eval_threshold, frequency_threshold = frequency_threshold, evaluation_cache = evaluation_cache)
     clf_apriori.load_data(df)
     clf_apriori.search()
 
@@ -20,7 +23,7 @@ def generateResults(dataset : str, eval_metric : str, depth : int, eval_threshol
         apriori_results.append(i.to_string())
     print("--------------------------------------------------------------------------------------------------")
     clf_bestfirst = EPM(depth = depth, evaluation_metric = eval_metric, bin_strategy = 'equiwidth', algorithm = 'best_first', 
-                        evaluation_threshold = eval_threshold)
+                        evaluation_threshold = eval_threshold, evaluation_cache = evaluation_cache)
     clf_bestfirst.load_data(df)
     clf_bestfirst.search()
 